@@ -0,0 +1,261 @@
+import argparse
+import contextlib
+import io
+import json
+import os
+import random
+import tempfile
+import time
+import tracemalloc
+
+import main
+from main import MatrixEngine
+
+
+def generate_attainment_data(student_count, program_count=12, course_count=10, density=0.5, seed=0):
+    rng = random.Random(seed)
+    program_outcomes = [(i, f"PO {i}") for i in range(1, program_count + 1)]
+    course_outcomes = [(i, f"CO {i}") for i in range(1, course_count + 1)]
+    relations = [
+        (program_id, course_id, round(rng.random(), 2))
+        for program_id, _ in program_outcomes
+        for course_id, _ in course_outcomes
+        if rng.random() < density
+    ]
+    students = [(1000 + s,) for s in range(student_count)]
+    success_rates = [
+        (student[0], course_id, round(rng.uniform(0, 100), 2))
+        for student in students
+        for course_id, _ in course_outcomes
+    ]
+    return program_outcomes, course_outcomes, relations, students, success_rates
+
+
+def scan_attainment(program_outcomes, course_outcomes, relations, students, success_rates):
+    # create_table5'in eski hali: her öğrenci ve her (PO, CO) için doğrusal arama
+    ratios = []
+    for student in students:
+        success_rate_for_student = [sr[2] for sr in success_rates if sr[0] == student[0]]
+        for program_outcome in program_outcomes:
+            relation_values = []
+            for course_outcome, success_rate in zip(course_outcomes, success_rate_for_student):
+                relation_value = next(
+                    (relation[2] for relation in relations if
+                     relation[0] == program_outcome[0] and relation[1] == course_outcome[0]),
+                    0
+                )
+                relation_values.append(relation_value)
+
+            row_values = [relation * rate for relation, rate in zip(relation_values, success_rate_for_student)]
+            avg_success = sum(row_values) / len(course_outcomes)
+            avg_relation_value = sum(relation_values) / len(relation_values) if relation_values else 0
+            ratios.append(avg_success / avg_relation_value if avg_relation_value else 0)
+    return ratios
+
+
+def indexed_attainment(program_outcomes, course_outcomes, relations, students, success_rates):
+    engine = MatrixEngine(program_outcomes, course_outcomes, relations, [], [])
+    student_ids = [student[0] for student in students]
+    success_matrix = engine.index_success_rates(student_ids, success_rates)
+    values, ratios = engine.attainment(success_matrix)
+    return ratios.ravel().tolist()
+
+
+def timed(function, *args):
+    start = time.perf_counter()
+    result = function(*args)
+    return time.perf_counter() - start, result
+
+
+def bench_attainment(student_counts, max_scan_students):
+    print(f"{'students':>10} {'scan (s)':>12} {'indexed (s)':>12} {'speedup':>10}")
+    for student_count in student_counts:
+        data = generate_attainment_data(student_count)
+        indexed_time, indexed_ratios = timed(indexed_attainment, *data)
+
+        if student_count <= max_scan_students:
+            scan_time, scan_ratios = timed(scan_attainment, *data)
+            assert all(abs(a - b) < 1e-6 for a, b in zip(scan_ratios, indexed_ratios))
+            print(f"{student_count:>10} {scan_time:>12.4f} {indexed_time:>12.4f} {scan_time / indexed_time:>9.1f}x")
+        else:
+            print(f"{student_count:>10} {'-':>12} {indexed_time:>12.4f} {'-':>10}")
+
+
+DATASETS = {
+    "small": dict(programs=12, courses=10, criteria=4, students=200),
+    "medium": dict(programs=12, courses=10, criteria=4, students=2000),
+    "large": dict(programs=20, courses=15, criteria=6, students=10000),
+}
+
+
+def generate_dataset(programs, courses, criteria, students, density=0.5, seed=0):
+    rng = random.Random(seed)
+    criteria_names = [f"C{i}" for i in range(1, criteria + 1)]
+    weights = [100 // criteria + (1 if i < 100 % criteria else 0) for i in range(criteria)]
+    return {
+        "program_outcomes": [(f"PO {i}",) for i in range(1, programs + 1)],
+        "course_outcomes": [(f"CO {i}",) for i in range(1, courses + 1)],
+        "relations": [
+            (program_id, course_id, round(rng.random(), 2))
+            for program_id in range(1, programs + 1)
+            for course_id in range(1, courses + 1)
+            if rng.random() < density
+        ],
+        "criteria": list(zip(criteria_names, weights)),
+        "evaluation_relations": [
+            (course_id, name, 1 if rng.random() < density else 0)
+            for course_id in range(1, courses + 1)
+            for name in criteria_names
+        ],
+        "students": [
+            (1000 + s, *(round(rng.uniform(0, 100), 1) for _ in criteria_names))
+            for s in range(students)
+        ],
+    }
+
+
+def load_dataset(dataset, location=":memory:"):
+    main.set_backend(main.SqliteBackend(location))
+    main.check_tables()
+
+    criteria = [name for name, _ in dataset["criteria"]]
+    columns = ", ".join(f"[{name}]" for name in criteria)
+    placeholders = ", ".join("?" for _ in criteria)
+    with main.pooled_connection("RelationMatrix") as conn:
+        cursor = conn.cursor()
+        main.bulk_insert(cursor, "INSERT INTO ProgramOutcomes (data) VALUES (?)", dataset["program_outcomes"])
+        main.bulk_insert(cursor, "INSERT INTO CourseOutcomes (data) VALUES (?)", dataset["course_outcomes"])
+        main.bulk_insert(cursor, "INSERT INTO ProgramCourseRelations (ProgramOutcomeID, CourseOutcomeID, "
+                                 "RelationValue) VALUES (?, ?, ?)", dataset["relations"])
+        main.bulk_insert(cursor, "INSERT INTO EvaluationCriteria (Criteria, Weight) VALUES (?, ?)",
+                         dataset["criteria"])
+        main.bulk_insert(cursor, "INSERT INTO CourseEvaluationRelations (CourseOutcomeID, Criteria, RelationValue) "
+                                 "VALUES (?, ?, ?)", dataset["evaluation_relations"])
+        cursor.execute(f"CREATE TABLE Students ({', '.join(main.student_table_columns(criteria))});")
+        main.bulk_insert(cursor, f"INSERT INTO Students (Student, {columns}, Course) VALUES (?, {placeholders}, ?)",
+                         [(*student, main.DEFAULT_COURSE) for student in dataset["students"]])
+        conn.commit()
+
+
+def measure(function, *args, trace_memory=True):
+    # Raporlama fonksiyonlarının print çıktıları JSON raporuna karışmasın
+    with contextlib.redirect_stdout(io.StringIO()):
+        start = time.perf_counter()
+        result = function(*args)
+        elapsed = time.perf_counter() - start
+
+        # tracemalloc süreyi şişirdiği için bellek tepe değeri ayrı bir çalıştırmada ölçülür
+        peak = None
+        if trace_memory:
+            tracemalloc.start()
+            function(*args)
+            _, peak = tracemalloc.get_traced_memory()
+            tracemalloc.stop()
+    return elapsed, peak, result
+
+
+def pipeline_stages(stream):
+    # load_snapshot'tan sonraki aşamalar, gerçek çalıştırmadaki gibi aynı anlık görüntüyü kullanır
+    return [
+        ("fetch_table_data", lambda snapshot: main.fetch_table_data("ProgramOutcomes")),
+        ("fetch_relations", lambda snapshot: main.fetch_relations()),
+        ("fetch_evaluation_data", lambda snapshot: main.fetch_evaluation_data()),
+        ("fetch_evaluation_relations", lambda snapshot: main.fetch_evaluation_relations()),
+        ("fetch_student_data", lambda snapshot: main.fetch_student_data()),
+        ("create_table1", main.create_table1),
+        ("create_table2", main.create_table2),
+        ("create_table3", main.create_table3),
+        ("save_table3_to_database", main.save_table3_to_database),
+        ("create_notes", main.create_notes),
+        ("create_table4", lambda snapshot: main.create_table4(snapshot, stream=stream)),
+        ("save_table4_to_database", main.save_table4_to_database),
+        ("fetch_success_rate", lambda snapshot: main.fetch_success_rate()),
+        ("create_table5", lambda snapshot: main.create_table5(snapshot, stream=stream)),
+    ]
+
+
+def bench_pipeline(name, sizes, density, stream=False, seed=0, trace_memory=True):
+    dataset = generate_dataset(density=density, seed=seed, **sizes)
+    student_count = sizes["students"]
+    report = {"dataset": name, **sizes, "density": density, "relations": len(dataset["relations"]),
+              "stream": stream, "stages": []}
+
+    def record(stage, elapsed, peak):
+        report["stages"].append({
+            "stage": stage,
+            "seconds": round(elapsed, 6),
+            "peak_memory_bytes": peak,
+            "students_per_second": round(student_count / elapsed, 1) if elapsed else None,
+        })
+
+    previous = os.getcwd()
+    with tempfile.TemporaryDirectory() as directory:
+        os.chdir(directory)
+        try:
+            elapsed, peak, _ = measure(load_dataset, dataset, os.path.join(directory, "benchmark.db"),
+                                       trace_memory=False)
+            record("load_dataset", elapsed, peak)
+
+            elapsed, peak, snapshot = measure(main.load_snapshot, trace_memory=trace_memory)
+            record("load_snapshot", elapsed, peak)
+
+            for stage, function in pipeline_stages(stream):
+                elapsed, peak, _ = measure(function, snapshot, trace_memory=trace_memory)
+                record(stage, elapsed, peak)
+        finally:
+            main.close_pools()
+            os.chdir(previous)
+
+    timed_stages = [stage for stage in report["stages"] if stage["stage"] != "load_dataset"]
+    total = sum(stage["seconds"] for stage in timed_stages)
+    report["total_seconds"] = round(total, 6)
+    report["students_per_second"] = round(student_count / total, 1) if total else None
+    if trace_memory:
+        report["peak_memory_bytes"] = max(stage["peak_memory_bytes"] for stage in timed_stages)
+    return report
+
+
+def run_pipeline(args):
+    sizes = {"programs": args.programs, "courses": args.courses, "criteria": args.criteria,
+             "students": args.students}
+    if args.datasets:
+        runs = [(name, DATASETS[name]) for name in args.datasets.split(",")]
+    else:
+        runs = [("custom", {key: value or DATASETS["small"][key] for key, value in sizes.items()})]
+
+    reports = [bench_pipeline(name, dataset_sizes, args.density, args.stream, args.seed, not args.no_memory)
+               for name, dataset_sizes in runs]
+    output = json.dumps(reports, indent=2)
+    if args.output:
+        with open(args.output, "w") as file:
+            file.write(output + "\n")
+    print(output)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="RelationMatrix benchmarks")
+    subparsers = parser.add_subparsers(dest="command", required=True)
+
+    attainment = subparsers.add_parser("attainment", help="Table 5 attainment: linear scan vs indexed engine")
+    attainment.add_argument("--students", default="100,500,1000,2000,5000,10000",
+                            help="comma separated student counts")
+    attainment.add_argument("--max-scan-students", type=int, default=2000,
+                            help="skip the linear-scan baseline above this many students")
+
+    pipeline = subparsers.add_parser("pipeline", help="time every report stage on a synthetic SQLite dataset")
+    pipeline.add_argument("--datasets", help=f"comma separated presets: {', '.join(DATASETS)}")
+    pipeline.add_argument("--programs", type=int, help="number of program outcomes")
+    pipeline.add_argument("--courses", type=int, help="number of course outcomes")
+    pipeline.add_argument("--criteria", type=int, help="number of evaluation criteria")
+    pipeline.add_argument("--students", type=int, help="number of students")
+    pipeline.add_argument("--density", type=float, default=0.5, help="share of non-zero relations")
+    pipeline.add_argument("--stream", action="store_true", help="write tables 4 and 5 with write-only workbooks")
+    pipeline.add_argument("--seed", type=int, default=0)
+    pipeline.add_argument("--no-memory", action="store_true", help="skip the tracemalloc run of each stage")
+    pipeline.add_argument("--output", help="also write the JSON report to this file")
+    args = parser.parse_args()
+
+    if args.command == "attainment":
+        bench_attainment([int(count) for count in args.students.split(",")], args.max_scan_students)
+    else:
+        run_pipeline(args)
@@ -1,211 +1,1667 @@
-import pyodbc
-from openpyxl import Workbook
+import argparse
+import contextvars
+import cProfile
+import csv
+import hashlib
+import io
+import itertools
+import json
+import os
+import pstats
+import queue
+import shutil
+import sqlite3
+import threading
+import time
+import tracemalloc
+import zipfile
+from concurrent.futures import FIRST_COMPLETED, ProcessPoolExecutor, ThreadPoolExecutor, as_completed, wait
+from contextlib import contextmanager
+from datetime import datetime
+from functools import partial, wraps
+
+import numpy as np
+from openpyxl import Workbook, load_workbook
+from openpyxl.cell import Cell, WriteOnlyCell
 from openpyxl.comments import Comment
+from openpyxl.utils import get_column_letter
+
+try:
+    import pyodbc
+except ImportError:
+    pyodbc = None
+
+try:
+    from scipy import sparse
+except ImportError:
+    sparse = None
+
+try:
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+except ImportError:
+    pa = None
+    pq = None
+
+POOL_SIZE = 5
+POOL_TIMEOUT = 30
+HEALTH_CHECK_INTERVAL = 60
+BATCH_SIZE = 1000
+FETCH_SIZE = 1000
+IN_LIST_SIZE = 500
+PIPELINE_DEPTH = 2
+METRICS_PATH = os.environ.get("RELATION_MATRIX_METRICS")
+PROFILE_MODE = None
+PROFILE_DIR = "profiles"
+CACHE_DIR = os.environ.get("RELATION_MATRIX_CACHE")
+CACHE_MAX_AGE = 7 * 24 * 60 * 60
+CACHE_MAX_BYTES = 1024 * 1024 * 1024
+SCORE_STORE_DIR = os.environ.get("RELATION_MATRIX_SCORE_STORE")
+SCORE_CHUNK_SIZE = 10000
+# store.json biçimi değişince eski kopyalar yeniden oluşturulur (2: boş notlar NaN olarak tutulur)
+SCORE_STORE_VERSION = 2
+STUDENT_SCHEMA = os.environ.get("RELATION_MATRIX_STUDENT_SCHEMA", "wide")
+SPARSE_RELATIONS = os.environ.get("RELATION_MATRIX_SPARSE_RELATIONS", "auto")
+SPARSE_MAX_DENSITY = 0.1
+SPARSE_MIN_CELLS = 100000
+DEFAULT_COURSE = "default"
+DEFAULT_PROGRAM = "default"
+
+
+class StorageBackend:
+    name = None
+    error = Exception
+    identity_column = None
+    concurrent_writes = True
+
+    def connect(self, database=None):
+        raise NotImplementedError
+
+    def ensure_database(self):
+        raise NotImplementedError
+
+    def table_exists(self, cursor, table_name):
+        raise NotImplementedError
+
+    def column_names(self, cursor, table_name):
+        raise NotImplementedError
+
+    def drop_table_if_exists(self, cursor, table_name):
+        if self.table_exists(cursor, table_name):
+            cursor.execute(f"DROP TABLE {table_name};")
+            return True
+        return False
+
+
+class SqlServerBackend(StorageBackend):
+    name = "sqlserver"
+    identity_column = "INT PRIMARY KEY IDENTITY(1,1)"
+
+    def __init__(self, server="ASUS\\SQLEXPRESS", driver="ODBC Driver 17 for SQL Server", database="RelationMatrix"):
+        if pyodbc is None:
+            raise RuntimeError("pyodbc is required for the SQL Server backend.")
+        self.server = server
+        self.driver = driver
+        self.database = database
+        self.error = pyodbc.Error
+
+    def connect(self, database=None):
+        connection_string = (
+            f"Driver={{{self.driver}}};"
+            f"Server={self.server};"
+            f"Database={database or 'master'};"
+            "Trusted_Connection=yes;"
+        )
+        return pyodbc.connect(connection_string)
+
+    def ensure_database(self):
+        conn = self.connect("master")
+        conn.autocommit = True
+        cursor = conn.cursor()
+
+        cursor.execute("SELECT database_id FROM sys.databases WHERE Name = ?", (self.database,))
+        database_exists = cursor.fetchone()
+
+        if database_exists:
+            print(f"There is already a database called {self.database}")
+        else:
+            cursor.execute(f"CREATE DATABASE {self.database}")
+            print(f"{self.database} database created")
 
+        conn.close()
 
-def get_connection(database=None):
-    connection_string = (
-        "Driver={ODBC Driver 17 for SQL Server};"
-        "Server=ASUS\\SQLEXPRESS;"
-        f"Database={database or 'master'};"
-        "Trusted_Connection=yes;"
-    )
-    return pyodbc.connect(connection_string)
+    def table_exists(self, cursor, table_name):
+        cursor.execute("SELECT COUNT(*) FROM INFORMATION_SCHEMA.TABLES WHERE TABLE_NAME = ?", (table_name,))
+        return cursor.fetchone()[0] > 0
 
+    def column_names(self, cursor, table_name):
+        cursor.execute("SELECT COLUMN_NAME FROM INFORMATION_SCHEMA.COLUMNS WHERE TABLE_NAME = ? "
+                       "ORDER BY ORDINAL_POSITION", (table_name,))
+        return [row[0] for row in cursor.fetchall()]
 
-def check_database():
-    conn = get_connection("master")
-    conn.autocommit = True
 
-    cursor = conn.cursor()
+# Bellek içi veritabanı adları; id() serbest kalan eski bir nesneninkiyle çakışıp onun verisini gösterebilir
+_memory_databases = itertools.count(1)
 
-    cursor.execute(f"SELECT database_id FROM sys.databases WHERE Name = 'RelationMatrix'")
-    database_exists = cursor.fetchone()
 
-    if database_exists:
-        print("There is already a database called RelationMatrix")
-    else:
-        cursor.execute("CREATE DATABASE RelationMatrix")
-        print("RelationMatrix database created")
+class SqliteBackend(StorageBackend):
+    name = "sqlite"
+    error = sqlite3.Error
+    identity_column = "INTEGER PRIMARY KEY AUTOINCREMENT"
+    concurrent_writes = False
 
-    conn.close()
+    def __init__(self, path="RelationMatrix.db"):
+        self.path = path
+        self._keep_alive = None
+        if path == ":memory:":
+            # Havuzdaki tüm bağlantılar aynı bellek içi veritabanını görsün
+            self.path = f"file:relation_matrix_{os.getpid()}_{next(_memory_databases)}?mode=memory&cache=shared"
+            self._keep_alive = self.connect()
 
+    def connect(self, database=None):
+        return sqlite3.connect(self.path, uri=self.path.startswith("file:"), check_same_thread=False)
 
-def check_tables():
-    conn = get_connection("RelationMatrix")
-    conn.autocommit = True
-    cursor = conn.cursor()
-
-    tables = ["CourseOutcomes", "ProgramOutcomes", "ProgramCourseRelations", "EvaluationCriteria",
-              "CourseEvaluationRelations"]
-    for table in tables:
-        cursor.execute(f"SELECT COUNT(*) FROM INFORMATION_SCHEMA.TABLES WHERE TABLE_NAME = '{table}'")
-        table_exists = cursor.fetchone()[0]
-        if table_exists:
-            print(f"{table} table already exists.")
+    def ensure_database(self):
+        print(f"Using SQLite database {self.path}")
+
+    def table_exists(self, cursor, table_name):
+        cursor.execute("SELECT COUNT(*) FROM sqlite_master WHERE type = 'table' AND name = ?", (table_name,))
+        return cursor.fetchone()[0] > 0
+
+    def column_names(self, cursor, table_name):
+        cursor.execute(f"PRAGMA table_info({table_name});")
+        return [row[1] for row in cursor.fetchall()]
+
+
+def create_backend(name, location=None):
+    if name == "sqlserver":
+        return SqlServerBackend(server=location) if location else SqlServerBackend()
+    if name == "sqlite":
+        return SqliteBackend(location) if location else SqliteBackend()
+    raise ValueError(f"Unknown storage backend: {name}")
+
+
+_backend = None
+
+
+def get_backend():
+    global _backend
+
+    if _backend is None:
+        _backend = create_backend(os.environ.get("RELATION_MATRIX_BACKEND", "sqlserver"),
+                                  os.environ.get("RELATION_MATRIX_LOCATION"))
+    return _backend
+
+
+def set_backend(backend):
+    global _backend
+
+    close_pools()
+    _backend = backend
+
+
+class ConnectionPool:
+    def __init__(self, database, size=POOL_SIZE, timeout=POOL_TIMEOUT, health_check_interval=HEALTH_CHECK_INTERVAL):
+        self.database = database
+        self.size = size
+        self.timeout = timeout
+        self.health_check_interval = health_check_interval
+        self.backend = get_backend()
+        self._idle = queue.LifoQueue()
+        self._lock = threading.Lock()
+        self._opened = 0
+
+    def _is_alive(self, conn):
+        try:
+            cursor = conn.cursor()
+            cursor.execute("SELECT 1;")
+            cursor.fetchall()
+            cursor.close()
+            return True
+        except self.backend.error:
+            return False
+
+    def _discard(self, conn):
+        try:
+            conn.close()
+        except self.backend.error:
+            pass
+        with self._lock:
+            self._opened -= 1
+
+    def acquire(self):
+        try:
+            conn, last_used = self._idle.get_nowait()
+        except queue.Empty:
+            with self._lock:
+                can_open = self._opened < self.size
+                if can_open:
+                    self._opened += 1
+            if can_open:
+                try:
+                    return self.backend.connect(self.database)
+                except self.backend.error:
+                    with self._lock:
+                        self._opened -= 1
+                    raise
+            try:
+                conn, last_used = self._idle.get(timeout=self.timeout)
+            except queue.Empty:
+                raise TimeoutError(f"No free connection to {self.database} after {self.timeout} seconds.")
+
+        # Uzun süre boşta kalan bağlantıyı kullanmadan önce kontrol et
+        if time.monotonic() - last_used > self.health_check_interval and not self._is_alive(conn):
+            self._discard(conn)
+            with self._lock:
+                self._opened += 1
+            try:
+                conn = self.backend.connect(self.database)
+            except self.backend.error:
+                with self._lock:
+                    self._opened -= 1
+                raise
+        return conn
+
+    def release(self, conn):
+        try:
+            conn.rollback()
+        except self.backend.error:
+            self._discard(conn)
+            return
+        self._idle.put((conn, time.monotonic()))
+
+    def close(self):
+        while True:
+            try:
+                conn, _ = self._idle.get_nowait()
+            except queue.Empty:
+                break
+            self._discard(conn)
+
+
+_pools = {}
+_pools_lock = threading.Lock()
+
+
+def configure_pool(size=None, timeout=None, health_check_interval=None):
+    global POOL_SIZE, POOL_TIMEOUT, HEALTH_CHECK_INTERVAL
+
+    if size is not None:
+        POOL_SIZE = size
+    if timeout is not None:
+        POOL_TIMEOUT = timeout
+    if health_check_interval is not None:
+        HEALTH_CHECK_INTERVAL = health_check_interval
+    close_pools()
+
+
+def get_pool(database="RelationMatrix"):
+    with _pools_lock:
+        pool = _pools.get(database)
+        if pool is None:
+            pool = ConnectionPool(database, POOL_SIZE, POOL_TIMEOUT, HEALTH_CHECK_INTERVAL)
+            _pools[database] = pool
+        return pool
+
+
+def close_pools():
+    with _pools_lock:
+        pools = list(_pools.values())
+        _pools.clear()
+    for pool in pools:
+        pool.close()
+
+
+_metrics_lock = threading.Lock()
+_active_stages = threading.local()
+# cProfile ve tracemalloc süreç genelinde tektir; aynı anda yalnızca bir aşama profillenir
+_profile_lock = threading.Lock()
+
+
+def configure_metrics(path=None, profile=None, profile_dir=None):
+    global METRICS_PATH, PROFILE_MODE, PROFILE_DIR
+
+    if profile not in (None, "cprofile", "tracemalloc"):
+        raise ValueError(f"Unknown profile mode: {profile}")
+    METRICS_PATH = path
+    PROFILE_MODE = profile
+    if profile_dir is not None:
+        PROFILE_DIR = profile_dir
+
+
+class StageMetrics:
+    def __init__(self, stage):
+        self.stage = stage
+        self.queries = 0
+        self.rows_read = 0
+        self.rows_written = 0
+        self.cells_written = 0
+        self.bytes_saved = 0
+
+
+def active_stages():
+    return getattr(_active_stages, "stack", [])
+
+
+def count_metric(name, amount=1):
+    # İç içe aşamalarda (ör. create_table5 içindeki fetch_success_rate) sayaçlar dıştaki aşamaya da eklenir
+    for metrics in active_stages():
+        setattr(metrics, name, getattr(metrics, name) + amount)
+
+
+def write_metrics(record):
+    with _metrics_lock:
+        with open(METRICS_PATH, "a", encoding="utf-8") as file:
+            file.write(json.dumps(record) + "\n")
+
+
+def instrumented(function):
+    @wraps(function)
+    def wrapper(*args, **kwargs):
+        if METRICS_PATH is None and PROFILE_MODE is None:
+            return function(*args, **kwargs)
+
+        stack = active_stages()
+        _active_stages.stack = stack = stack + [StageMetrics(function.__name__)]
+        metrics = stack[-1]
+
+        # cProfile ve tracemalloc iç içe başlatılamaz, yalnızca en dıştaki aşama profillenir.
+        # Başka bir iş parçacığında profillenen aşama varsa bu aşama profillenmeden çalışır.
+        profiler = None
+        tracing = False
+        profiling = False
+        skipped = False
+        if len(stack) == 1 and PROFILE_MODE is not None:
+            profiling = _profile_lock.acquire(blocking=False)
+            skipped = not profiling
+        if profiling:
+            if PROFILE_MODE == "cprofile":
+                profiler = cProfile.Profile()
+                profiler.enable()
+            elif PROFILE_MODE == "tracemalloc" and not tracemalloc.is_tracing():
+                tracemalloc.start()
+                tracing = True
+        elif skipped:
+            print(f"{function.__name__} is not profiled, another stage is being profiled.")
+
+        started = datetime.now()
+        start = time.perf_counter()
+        status = "ok"
+        try:
+            return function(*args, **kwargs)
+        except BaseException:
+            status = "error"
+            raise
+        finally:
+            elapsed = time.perf_counter() - start
+            _active_stages.stack = stack[:-1]
+            record = {
+                "stage": metrics.stage,
+                "started": started.isoformat(timespec="milliseconds"),
+                "seconds": round(elapsed, 6),
+                "status": status,
+                "queries": metrics.queries,
+                "rows_read": metrics.rows_read,
+                "rows_written": metrics.rows_written,
+                "cells_written": metrics.cells_written,
+                "bytes_saved": metrics.bytes_saved,
+            }
+            try:
+                if profiler is not None:
+                    profiler.disable()
+                    record.update(dump_profile(profiler, metrics.stage, started))
+                if tracing:
+                    record.update(dump_memory_profile(tracemalloc.take_snapshot()))
+                    record["peak_memory_bytes"] = tracemalloc.get_traced_memory()[1]
+                    tracemalloc.stop()
+            finally:
+                if profiling:
+                    _profile_lock.release()
+            if profiler is not None or tracing:
+                # Sıcak noktalar --metrics verilmese de aşama başına bir JSON dosyasına yazılır
+                with open(profile_path(metrics.stage, started, ".json"), "w", encoding="utf-8") as file:
+                    json.dump(record, file, indent=2)
+            if skipped:
+                record["profile_skipped"] = True
+            if METRICS_PATH is not None:
+                write_metrics(record)
+
+    return wrapper
+
+
+def profile_path(stage, started, extension):
+    os.makedirs(PROFILE_DIR, exist_ok=True)
+    return os.path.join(PROFILE_DIR, f"{stage}-{started:%Y%m%d-%H%M%S-%f}{extension}")
+
+
+def dump_profile(profiler, stage, started, limit=10):
+    filename = profile_path(stage, started, ".prof")
+    profiler.dump_stats(filename)
+
+    stats = pstats.Stats(profiler)
+    hot_spots = []
+    for (path, line, name), (_, calls, total_time, cumulative_time, _) in stats.stats.items():
+        hot_spots.append({"function": f"{os.path.basename(path)}:{line}({name})", "calls": calls,
+                          "total_seconds": round(total_time, 6), "cumulative_seconds": round(cumulative_time, 6)})
+    hot_spots.sort(key=lambda spot: spot["total_seconds"], reverse=True)
+    return {"profile": filename, "hot_spots": hot_spots[:limit]}
+
+
+def dump_memory_profile(snapshot, limit=10):
+    hot_spots = [{"line": str(statistic.traceback), "bytes": statistic.size, "blocks": statistic.count}
+                 for statistic in snapshot.statistics("lineno")[:limit]]
+    return {"hot_spots": hot_spots}
+
+
+class MeteredCursor:
+    def __init__(self, cursor):
+        object.__setattr__(self, "_cursor", cursor)
+
+    def __getattr__(self, name):
+        return getattr(self._cursor, name)
+
+    def __setattr__(self, name, value):
+        setattr(self._cursor, name, value)
+
+    def __iter__(self):
+        for row in self._cursor:
+            count_metric("rows_read")
+            yield row
+
+    def _count_written(self, query, default):
+        if query.lstrip().split(None, 1)[0].upper() in ("INSERT", "UPDATE", "DELETE", "MERGE"):
+            rowcount = self._cursor.rowcount
+            count_metric("rows_written", rowcount if rowcount is not None and rowcount >= 0 else default)
+
+    def execute(self, query, *params):
+        self._cursor.execute(query, *params)
+        count_metric("queries")
+        self._count_written(query, 1)
+        return self
+
+    def executemany(self, query, rows):
+        rows = list(rows)
+        self._cursor.executemany(query, rows)
+        count_metric("queries")
+        self._count_written(query, len(rows))
+        return self
+
+    def fetchone(self):
+        row = self._cursor.fetchone()
+        if row is not None:
+            count_metric("rows_read")
+        return row
+
+    def fetchmany(self, *size):
+        rows = self._cursor.fetchmany(*size)
+        count_metric("rows_read", len(rows))
+        return rows
+
+    def fetchall(self):
+        rows = self._cursor.fetchall()
+        count_metric("rows_read", len(rows))
+        return rows
+
+
+class MeteredConnection:
+    def __init__(self, conn):
+        self._conn = conn
+
+    def __getattr__(self, name):
+        return getattr(self._conn, name)
+
+    def cursor(self):
+        return MeteredCursor(self._conn.cursor())
+
+
+def save_workbook(workbook, filename):
+    if active_stages() and not workbook.write_only:
+        # write-only sayfalardaki hücreler append_report_row'da sayılır
+        count_metric("cells_written", sum(1 for sheet in workbook.worksheets
+                                          for row in sheet.iter_rows(values_only=True)
+                                          for value in row if value is not None))
+    workbook.save(filename)
+    if active_stages():
+        count_metric("bytes_saved", os.path.getsize(filename))
+
+
+def configure_fetch_size(size):
+    global FETCH_SIZE
+
+    FETCH_SIZE = size
+
+
+def iter_row_chunks(cursor, arraysize=None):
+    # Sonuç kümesini bütünüyle belleğe almak yerine arraysize'lık parçalar halinde oku
+    cursor.arraysize = arraysize or FETCH_SIZE
+    while True:
+        rows = cursor.fetchmany()
+        if not rows:
+            break
+        yield rows
+
+
+def stream_query(query, params=(), arraysize=None, database="RelationMatrix", depth=0):
+    # Bağlantı, üreteç tüketilene ya da kapatılana kadar havuza dönmez.
+    # depth > 0 ise sonraki parçalar, önceki parça işlenirken arka planda okunur.
+    with pooled_connection(database) as conn:
+        cursor = conn.cursor()
+        cursor.execute(query, params)
+        for rows in prefetch(iter_row_chunks(cursor, arraysize), depth):
+            yield from rows
+
+
+def configure_pipeline(depth):
+    global PIPELINE_DEPTH
+
+    PIPELINE_DEPTH = depth
+
+
+def prefetch(iterable, depth=None):
+    # iterable arka plandaki bir iş parçacığında ilerletilir; tüketici bir parçayı işlerken (hesap, Excel yazımı)
+    # sonraki parçalar okunur/hesaplanır. Sınırlı kuyruk, üreticinin en fazla depth parça önde gitmesini sağlar.
+    depth = PIPELINE_DEPTH if depth is None else depth
+    if depth <= 0:
+        yield from iterable
+        return
+
+    items = queue.Queue(maxsize=depth)
+    stopped = threading.Event()
+    stages = active_stages()
+    done = object()
+
+    def put(item):
+        while not stopped.is_set():
+            try:
+                items.put(item, timeout=0.1)
+                return True
+            except queue.Full:
+                pass
+        return False
+
+    def produce():
+        # Üreticinin sorguları ve satırları da tüketicinin aşamasına sayılsın
+        _active_stages.stack = stages
+        try:
+            for item in iterable:
+                if not put((item, None)):
+                    return
+        except Exception as error:
+            put((done, error))
         else:
-            if table == 'CourseOutcomes':
-                cursor.execute('''
-                    CREATE TABLE CourseOutcomes (
-                        id INT PRIMARY KEY IDENTITY(1,1),
-                        data TEXT NOT NULL
-                    );
-                ''')
-            elif table == 'ProgramOutcomes':
-                cursor.execute('''
-                    CREATE TABLE ProgramOutcomes (
-                        id INT PRIMARY KEY IDENTITY(1,1),
-                        data TEXT NOT NULL
-                    );
-                ''')
-            elif table == 'ProgramCourseRelations':
-                cursor.execute('''
-                    CREATE TABLE ProgramCourseRelations (
-                        ProgramOutcomeID INT NOT NULL,
-                        CourseOutcomeID INT NOT NULL,
-                        RelationValue FLOAT NOT NULL CHECK (RelationValue BETWEEN 0 AND 1),
-                        PRIMARY KEY (ProgramOutcomeID, CourseOutcomeID),
-                        FOREIGN KEY (ProgramOutcomeID) REFERENCES ProgramOutcomes(id),
-                        FOREIGN KEY (CourseOutcomeID) REFERENCES CourseOutcomes(id)
-                    );
-                ''')
-            elif table == 'EvaluationCriteria':
-                cursor.execute('''
-                    CREATE TABLE EvaluationCriteria (
-                        Criteria VARCHAR(25) PRIMARY KEY,
-                        Weight INT NOT NULL
-                    );
-                ''')
-            elif table == 'CourseEvaluationRelations':
-                cursor.execute('''
-                    CREATE TABLE CourseEvaluationRelations (
-                        CourseOutcomeID INT NOT NULL,
-                        Criteria VARCHAR(25),
-                        RelationValue INT NOT NULL,
-                        PRIMARY KEY (CourseOutcomeID, Criteria),
-                        FOREIGN KEY (CourseOutcomeID) REFERENCES CourseOutcomes(id),
-                        FOREIGN KEY (Criteria) REFERENCES EvaluationCriteria(Criteria),
-                    );
-                ''')
-            print(f"{table} table created.")
-
-    conn.close()
+            put((done, None))
+
+    producer = threading.Thread(target=contextvars.copy_context().run, args=(produce,), daemon=True)
+    producer.start()
+    try:
+        while True:
+            item, error = items.get()
+            if item is done:
+                if error is not None:
+                    raise error
+                return
+            yield item
+    finally:
+        # Tüketici erken bırakırsa üretici bir sonraki put'ta durur
+        stopped.set()
+        producer.join()
+
+
+def bulk_insert(cursor, query, rows, batch_size=None):
+    batch_size = batch_size or BATCH_SIZE
+    # pyodbc'de parametre dizisini sunucuya tek seferde gönder
+    if hasattr(cursor, "fast_executemany"):
+        cursor.fast_executemany = True
+
+    inserted = 0
+    batch = []
+    for row in rows:
+        batch.append(row)
+        if len(batch) >= batch_size:
+            cursor.executemany(query, batch)
+            inserted += len(batch)
+            batch = []
+    if batch:
+        cursor.executemany(query, batch)
+        inserted += len(batch)
+    return inserted
+
+
+@contextmanager
+def pooled_connection(database="RelationMatrix"):
+    pool = get_pool(database)
+    conn = pool.acquire()
+    try:
+        yield MeteredConnection(conn) if active_stages() else conn
+    finally:
+        pool.release(conn)
+
+
+_current_course = contextvars.ContextVar("course", default=DEFAULT_COURSE)
+_output_dir = contextvars.ContextVar("output_dir", default="")
+
+# Bir dersin ders çıktıları; ders anahtarı olmayan tablolar bu alt sorguyla derse göre süzülür
+COURSE_OUTCOME_IDS = "SELECT id FROM CourseOutcomes WHERE Course = ?"
+
+
+def current_course():
+    return _current_course.get()
+
+
+@contextmanager
+def use_course(course, output_dir=None):
+    # Ders bağlama özeldir; farklı dersler aynı anda farklı iş parçacıklarında işlenebilir
+    course_token = _current_course.set(course)
+    output_token = _output_dir.set(_output_dir.get() if output_dir is None else output_dir)
+    try:
+        yield
+    finally:
+        _output_dir.reset(output_token)
+        _current_course.reset(course_token)
+
+
+def report_path(filename):
+    directory = _output_dir.get()
+    if not directory:
+        return filename
+    os.makedirs(directory, exist_ok=True)
+    return os.path.join(directory, filename)
+
+
+def course_program(cursor, course=None):
+    course = course or current_course()
+    if get_backend().table_exists(cursor, "Courses"):
+        cursor.execute("SELECT Program FROM Courses WHERE Course = ?", (course,))
+        row = cursor.fetchone()
+        if row is not None:
+            return row[0]
+    return DEFAULT_PROGRAM
+
+
+def register_course(course, program=DEFAULT_PROGRAM):
+    with pooled_connection("RelationMatrix") as conn:
+        cursor = conn.cursor()
+        cursor.execute("DELETE FROM Courses WHERE Course = ?", (course,))
+        cursor.execute("INSERT INTO Courses (Course, Program) VALUES (?, ?)", (course, program))
+        conn.commit()
+    print(f"Course {course} registered for program {program}.")
+
+
+def list_courses():
+    with pooled_connection("RelationMatrix") as conn:
+        cursor = conn.cursor()
+        cursor.execute("SELECT Course FROM Courses UNION SELECT Course FROM CourseOutcomes ORDER BY 1;")
+        return [row[0] for row in cursor.fetchall()]
+
+
+def ensure_column(cursor, table_name, column, definition):
+    # Tek dersli eski veritabanlarına ders/program anahtarını ekle; mevcut satırlar varsayılan derse düşer
+    if column in get_backend().column_names(cursor, table_name):
+        return False
+    cursor.execute(f"ALTER TABLE {table_name} ADD {column} {definition};")
+    return True
+
+
+def move_to_course_key(cursor, table_name, columns, create_table):
+    # Birincil anahtara Course eklemek tabloyu yeniden oluşturmayı gerektirir; satırlar varsayılan derse taşınır
+    column_list = ", ".join(f"[{column}]" for column in columns)
+    cursor.execute(f"SELECT {column_list} FROM {table_name};")
+    rows = [(*row, DEFAULT_COURSE) for row in cursor.fetchall()]
+    cursor.execute(f"DROP TABLE {table_name};")
+    create_table()
+    bulk_insert(cursor, f"INSERT INTO {table_name} ({column_list}, Course) "
+                        f"VALUES ({', '.join('?' for _ in columns)}, ?)", rows)
+
+
+def check_database():
+    get_backend().ensure_database()
+
+
+def check_tables():
+    backend = get_backend()
+
+    with pooled_connection("RelationMatrix") as conn:
+        cursor = conn.cursor()
+
+        tables = ["Courses", "CourseOutcomes", "ProgramOutcomes", "ProgramCourseRelations", "EvaluationCriteria",
+                  "CourseEvaluationRelations", "ChangeLog", "Materializations"]
+        for table in tables:
+            if backend.table_exists(cursor, table):
+                print(f"{table} table already exists.")
+            else:
+                if table == 'Courses':
+                    cursor.execute('''
+                        CREATE TABLE Courses (
+                            Course VARCHAR(40) PRIMARY KEY,
+                            Program VARCHAR(40) NOT NULL
+                        );
+                    ''')
+                elif table == 'CourseOutcomes':
+                    cursor.execute(f'''
+                        CREATE TABLE CourseOutcomes (
+                            id {backend.identity_column},
+                            data TEXT NOT NULL,
+                            Course VARCHAR(40) NOT NULL DEFAULT 'default'
+                        );
+                    ''')
+                    cursor.execute("CREATE INDEX IX_CourseOutcomes_Course ON CourseOutcomes (Course);")
+                elif table == 'ProgramOutcomes':
+                    cursor.execute(f'''
+                        CREATE TABLE ProgramOutcomes (
+                            id {backend.identity_column},
+                            data TEXT NOT NULL,
+                            Program VARCHAR(40) NOT NULL DEFAULT 'default'
+                        );
+                    ''')
+                elif table == 'ProgramCourseRelations':
+                    cursor.execute('''
+                        CREATE TABLE ProgramCourseRelations (
+                            ProgramOutcomeID INT NOT NULL,
+                            CourseOutcomeID INT NOT NULL,
+                            RelationValue FLOAT NOT NULL CHECK (RelationValue BETWEEN 0 AND 1),
+                            PRIMARY KEY (ProgramOutcomeID, CourseOutcomeID),
+                            FOREIGN KEY (ProgramOutcomeID) REFERENCES ProgramOutcomes(id),
+                            FOREIGN KEY (CourseOutcomeID) REFERENCES CourseOutcomes(id)
+                        );
+                    ''')
+                elif table == 'EvaluationCriteria':
+                    cursor.execute('''
+                        CREATE TABLE EvaluationCriteria (
+                            Criteria VARCHAR(25) PRIMARY KEY,
+                            Weight INT NOT NULL
+                        );
+                    ''')
+                elif table == 'CourseEvaluationRelations':
+                    cursor.execute('''
+                        CREATE TABLE CourseEvaluationRelations (
+                            CourseOutcomeID INT NOT NULL,
+                            Criteria VARCHAR(25),
+                            RelationValue INT NOT NULL,
+                            PRIMARY KEY (CourseOutcomeID, Criteria),
+                            FOREIGN KEY (CourseOutcomeID) REFERENCES CourseOutcomes(id),
+                            FOREIGN KEY (Criteria) REFERENCES EvaluationCriteria(Criteria)
+                        );
+                    ''')
+                elif table == 'ChangeLog':
+                    cursor.execute(f'''
+                        CREATE TABLE ChangeLog (
+                            id {backend.identity_column},
+                            Entity VARCHAR(40) NOT NULL,
+                            EntityKey VARCHAR(40) NOT NULL,
+                            Course VARCHAR(40) NOT NULL DEFAULT 'default'
+                        );
+                    ''')
+                elif table == 'Materializations':
+                    cursor.execute('''
+                        CREATE TABLE Materializations (
+                            Course VARCHAR(40) NOT NULL,
+                            TableName VARCHAR(25) NOT NULL,
+                            LastChangeID INT NOT NULL,
+                            PRIMARY KEY (Course, TableName)
+                        );
+                    ''')
+                print(f"{table} table created.")
+
+        if ensure_column(cursor, "CourseOutcomes", "Course", "VARCHAR(40) NOT NULL DEFAULT 'default'"):
+            cursor.execute("CREATE INDEX IX_CourseOutcomes_Course ON CourseOutcomes (Course);")
+            print("CourseOutcomes table now has a Course key.")
+        if ensure_column(cursor, "ProgramOutcomes", "Program", "VARCHAR(40) NOT NULL DEFAULT 'default'"):
+            print("ProgramOutcomes table now has a Program key.")
+        if ensure_column(cursor, "ChangeLog", "Course", "VARCHAR(40) NOT NULL DEFAULT 'default'"):
+            print("ChangeLog table now has a Course key.")
+        if "Course" not in backend.column_names(cursor, "Materializations"):
+            # Sadece önbellek niteliğinde; yeniden oluşturulunca bir sonraki çalıştırma tam yeniden hesaplar
+            cursor.execute("DROP TABLE Materializations;")
+            cursor.execute('''
+                CREATE TABLE Materializations (
+                    Course VARCHAR(40) NOT NULL,
+                    TableName VARCHAR(25) NOT NULL,
+                    LastChangeID INT NOT NULL,
+                    PRIMARY KEY (Course, TableName)
+                );
+            ''')
+        if backend.table_exists(cursor, "Students") and "Course" not in backend.column_names(cursor, "Students"):
+            criteria = backend.column_names(cursor, "Students")[1:]
+            move_to_course_key(cursor, "Students", ["Student", *criteria], lambda: cursor.execute(
+                f"CREATE TABLE Students ({', '.join(student_table_columns(criteria))});"))
+            print("Students table now has a Course key.")
+        if (backend.table_exists(cursor, "StudentScores")
+                and "Course" not in backend.column_names(cursor, "StudentScores")):
+            move_to_course_key(cursor, "StudentScores", ["Student", "Criteria", "Score"],
+                               lambda: create_student_scores_table(cursor))
+            print("StudentScores table now has a Course key.")
+
+        if STUDENT_SCHEMA == "long" and create_student_scores_table(cursor):
+            print("StudentScores table created.")
+
+        conn.commit()
+
+
+def configure_student_schema(schema):
+    global STUDENT_SCHEMA
+
+    if schema not in ("wide", "long"):
+        raise ValueError(f"Unknown student schema: {schema}")
+    STUDENT_SCHEMA = schema
+
+
+def student_table():
+    # wide: Students tablosunda kriter başına bir sütun, long: StudentScores(Student, Criteria, Score)
+    return "StudentScores" if STUDENT_SCHEMA == "long" else "Students"
+
+
+def create_student_scores_table(cursor):
+    if get_backend().table_exists(cursor, "StudentScores"):
+        return False
+
+    # Kriter silinse de notlar kaybolmasın diye EvaluationCriteria'ya yabancı anahtar yok
+    cursor.execute('''
+        CREATE TABLE StudentScores (
+            Student INT NOT NULL,
+            Criteria VARCHAR(25) NOT NULL,
+            Score FLOAT,
+            Course VARCHAR(40) NOT NULL DEFAULT 'default',
+            PRIMARY KEY (Course, Student, Criteria)
+        );
+    ''')
+    cursor.execute("CREATE INDEX IX_StudentScores_Criteria ON StudentScores (Course, Criteria, Student);")
+    return True
+
+
+def student_scores_query(criteria, available=None):
+    # Her iki düzende de geçerli dersin her öğrencisi için bir satır ve kriter başına bir sütun döndürür.
+    # available: geniş Students tablosundaki kriter sütunları; olmayanlar boş (NULL) not olarak döner.
+    if STUDENT_SCHEMA == "long":
+        columns = "".join(f", MAX(CASE WHEN Criteria = ? THEN Score END) AS [{criterion}]" for criterion in criteria)
+        return (f"SELECT Student{columns} FROM StudentScores WHERE Course = ? GROUP BY Student",
+                [*criteria, current_course()])
+    columns = "".join(f", [{criterion}]" if available is None or criterion in available else f", NULL AS [{criterion}]"
+                      for criterion in criteria)
+    return f"SELECT Student{columns} FROM Students WHERE Course = ?", [current_course()]
+
+
+def student_count_query():
+    if STUDENT_SCHEMA == "long":
+        return "SELECT COUNT(DISTINCT Student) FROM StudentScores WHERE Course = ?;", (current_course(),)
+    return "SELECT COUNT(*) FROM Students WHERE Course = ?;", (current_course(),)
+
+
+def wide_student_criteria(cursor):
+    return [column for column in get_backend().column_names(cursor, "Students")[1:] if column != "Course"]
+
+
+def student_score_rows(rows, criteria):
+    # Geniş satırları (öğrenci, kriter, not, ders) satırlarına çevir; boş notlar yazılmaz
+    course = current_course()
+    for row in rows:
+        for criterion, score in zip(criteria, row[1:]):
+            if score is not None:
+                yield row[0], criterion, score, course
+
+
+def migrate_students_to_long(drop_wide=False, force=False):
+    backend = get_backend()
+
+    with pooled_connection("RelationMatrix") as conn:
+        cursor = conn.cursor()
+
+        if not backend.table_exists(cursor, "Students"):
+            print("Students table does not exist, nothing to migrate.")
+            return 0
+
+        create_student_scores_table(cursor)
+        ensure_column(cursor, "Students", "Course", "VARCHAR(40) NOT NULL DEFAULT 'default'")
+        criteria = wide_student_criteria(cursor)
+
+        # Uzun düzende girilmiş notlar sessizce silinmez; üzerine yazmak için force gerekir
+        cursor.execute("SELECT COUNT(*) FROM StudentScores;")
+        existing = cursor.fetchone()[0]
+        if existing and not force:
+            print(f"StudentScores already has {existing} scores, use --force to replace them.")
+            return 0
+
+        # Veri sunucudan çıkmadan her kriter sütunu tek bir INSERT ... SELECT ile taşınır; tüm dersler birlikte
+        cursor.execute("DELETE FROM StudentScores;")
+        migrated = 0
+        for criterion in criteria:
+            cursor.execute(f"INSERT INTO StudentScores (Student, Criteria, Score, Course) "
+                           f"SELECT Student, ?, [{criterion}], Course FROM Students WHERE [{criterion}] IS NOT NULL;",
+                           (criterion,))
+            migrated += max(cursor.rowcount, 0)
+
+        if drop_wide:
+            cursor.execute("DROP TABLE Students;")
+        cursor.execute("SELECT DISTINCT Course FROM StudentScores;")
+        for (course,) in cursor.fetchall():
+            with use_course(course):
+                log_change(cursor, "Student", "*")
+        conn.commit()
+
+    print(f"{migrated} scores migrated to StudentScores.")
+    return migrated
+
+
+CHANGE_QUERY = "INSERT INTO ChangeLog (Entity, EntityKey, Course) VALUES (?, ?, ?)"
+
+
+def change_course(entity):
+    # Kriterler tüm derslerde ortak; değişiklikleri her dersi etkiler ("*")
+    return "*" if entity == "EvaluationCriteria" else current_course()
+
+
+def log_change(cursor, entity, key):
+    # key "*" tüm varlığın değiştiğini belirtir (ör. Students tablosu yeniden oluşturuldu)
+    cursor.execute(CHANGE_QUERY, (entity, str(key), change_course(entity)))
+
+
+def read_changes(cursor, table_name, change_id):
+    course = current_course()
+    cursor.execute("SELECT LastChangeID FROM Materializations WHERE Course = ? AND TableName = ?",
+                   (course, table_name))
+    materialized = cursor.fetchone()
+    if materialized is None or change_id is None:
+        return None
+
+    cursor.execute("SELECT Entity, EntityKey FROM ChangeLog WHERE id > ? AND id <= ? AND Course IN (?, '*')",
+                   (materialized[0], change_id, course))
+    changes = {}
+    for entity, key in cursor.fetchall():
+        changes.setdefault(entity, set()).add(key)
+    return changes
+
+
+def record_materialization(cursor, table_name, change_id):
+    if change_id is None:
+        return
+    course = current_course()
+    cursor.execute("DELETE FROM Materializations WHERE Course = ? AND TableName = ?", (course, table_name))
+    cursor.execute("INSERT INTO Materializations (Course, TableName, LastChangeID) VALUES (?, ?, ?)",
+                   (course, table_name, change_id))
 
 
 def insert_data_into_table(table_name, data):
-    conn = get_connection("RelationMatrix")
-    conn.autocommit = True
-    cursor = conn.cursor()
+    with pooled_connection("RelationMatrix") as conn:
+        cursor = conn.cursor()
 
-    if table_name == 'CourseOutcomes':
-        cursor.execute("INSERT INTO CourseOutcomes (data) VALUES (?)", data)
-    elif table_name == 'ProgramOutcomes':
-        cursor.execute("INSERT INTO ProgramOutcomes (data) VALUES (?)", data)
+        if table_name == 'CourseOutcomes':
+            cursor.execute("INSERT INTO CourseOutcomes (data, Course) VALUES (?, ?)", (data, current_course()))
+            cursor.execute("SELECT MAX(id) FROM CourseOutcomes;")
+            log_change(cursor, "CourseOutcome", cursor.fetchone()[0])
+        elif table_name == 'ProgramOutcomes':
+            cursor.execute("INSERT INTO ProgramOutcomes (data, Program) VALUES (?, ?)", (data, course_program(cursor)))
 
-    conn.close()
+        conn.commit()
 
 
+@instrumented
 def fetch_relations():
-    conn = get_connection("RelationMatrix")
-    cursor = conn.cursor()
+    with pooled_connection("RelationMatrix") as conn:
+        cursor = conn.cursor()
 
-    query = """
-    SELECT ProgramOutcomeID, CourseOutcomeID, RelationValue
-    FROM ProgramCourseRelations;
-    """
-    cursor.execute(query)
+        query = f"""
+        SELECT ProgramOutcomeID, CourseOutcomeID, RelationValue
+        FROM ProgramCourseRelations
+        WHERE CourseOutcomeID IN ({COURSE_OUTCOME_IDS});
+        """
+        cursor.execute(query, (current_course(),))
 
-    relations = cursor.fetchall()
-
-    cursor.close()
-    conn.close()
+        relations = cursor.fetchall()
 
     return relations
 
 
+@instrumented
 def fetch_evaluation_relations():
-    conn = get_connection("RelationMatrix")
-    cursor = conn.cursor()
-
-    query = """
-    SELECT CourseOutcomeID, Criteria ,RelationValue
-    FROM CourseEvaluationRelations;
-    """
-    cursor.execute(query)
+    with pooled_connection("RelationMatrix") as conn:
+        cursor = conn.cursor()
 
-    relations = cursor.fetchall()
+        query = f"""
+        SELECT CourseOutcomeID, Criteria ,RelationValue
+        FROM CourseEvaluationRelations
+        WHERE CourseOutcomeID IN ({COURSE_OUTCOME_IDS});
+        """
+        cursor.execute(query, (current_course(),))
 
-    cursor.close()
-    conn.close()
+        relations = cursor.fetchall()
 
     return relations
 
 
+@instrumented
 def fetch_table_data(table_name):
-    conn = get_connection("RelationMatrix")
-    cursor = conn.cursor()
+    with pooled_connection("RelationMatrix") as conn:
+        cursor = conn.cursor()
 
-    query = f"SELECT id, data FROM {table_name};"
-    cursor.execute(query)
-
-    data = cursor.fetchall()
+        if table_name == "ProgramOutcomes":
+            cursor.execute("SELECT id, data FROM ProgramOutcomes WHERE Program = ?;", (course_program(cursor),))
+        else:
+            cursor.execute(f"SELECT id, data FROM {table_name} WHERE Course = ?;", (current_course(),))
 
-    cursor.close()
-    conn.close()
+        data = cursor.fetchall()
 
     return data
 
 
+@instrumented
 def fetch_evaluation_data():
-    conn = get_connection("RelationMatrix")
-    cursor = conn.cursor()
-
-    query = "SELECT Criteria, Weight FROM EvaluationCriteria;"
-    cursor.execute(query)
-    data = cursor.fetchall()
+    with pooled_connection("RelationMatrix") as conn:
+        cursor = conn.cursor()
 
-    cursor.close()
-    conn.close()
+        query = "SELECT Criteria, Weight FROM EvaluationCriteria;"
+        cursor.execute(query)
+        data = cursor.fetchall()
 
     return data
 
 
-def fetch_student_data():
-    conn = get_connection("RelationMatrix")
-    cursor = conn.cursor()
+def iter_student_data(arraysize=None):
+    if STUDENT_SCHEMA == "long":
+        return stream_query("SELECT DISTINCT Student FROM StudentScores WHERE Course = ?;", (current_course(),),
+                            arraysize=arraysize)
+    return stream_query("SELECT Student FROM Students WHERE Course = ?;", (current_course(),), arraysize=arraysize)
 
-    query = "SELECT Student FROM Students;"
-    cursor.execute(query)
-    students = cursor.fetchall()
 
-    cursor.close()
-    conn.close()
+def iter_success_rate(arraysize=None, depth=0):
+    return stream_query(f"SELECT student_id, course_outcome_id, success_rate FROM Table4 "
+                        f"WHERE course_outcome_id IN ({COURSE_OUTCOME_IDS});", (current_course(),),
+                        arraysize=arraysize, depth=depth)
 
-    return students
 
+@instrumented
+def fetch_student_data():
+    return list(iter_student_data())
 
+
+@instrumented
 def fetch_success_rate():
-    conn = get_connection("RelationMatrix")
-    cursor = conn.cursor()
+    return list(iter_success_rate())
+
+
+class MatrixCache:
+    def __init__(self, directory, max_age=None, max_bytes=None):
+        self.directory = directory
+        self.max_age = max_age
+        self.max_bytes = max_bytes
+        self._lock = threading.Lock()
+        os.makedirs(directory, exist_ok=True)
+
+    def key(self, *parts):
+        # Girdilerin içeriğinden anahtar üret; kaynak tablolar değişince anahtar da değişir
+        digest = hashlib.sha256()
+        for part in parts:
+            if isinstance(part, np.ndarray):
+                digest.update(f"{part.dtype}{part.shape}".encode())
+                digest.update(np.ascontiguousarray(part).tobytes())
+            else:
+                digest.update(repr(part).encode())
+        return digest.hexdigest()
+
+    def _entry(self, name, key):
+        return os.path.join(self.directory, f"{name}-{key}")
+
+    def _expired(self, path):
+        return self.max_age is not None and time.time() - os.path.getmtime(path) > self.max_age
+
+    def load(self, name, key):
+        path = self._entry(name, key)
+        if not os.path.isdir(path):
+            return None
+        if self._expired(path):
+            shutil.rmtree(path, ignore_errors=True)
+            return None
+
+        files = sorted(os.listdir(path))
+        arrays = tuple(np.load(os.path.join(path, filename), mmap_mode="r") for filename in files)
+        # Son kullanım zamanını güncelle; boyut sınırında en eski kullanılan silinir
+        os.utime(path)
+        return arrays
+
+    def store(self, name, key, arrays):
+        path = self._entry(name, key)
+        temporary = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+        os.makedirs(temporary, exist_ok=True)
+        for i, array in enumerate(arrays):
+            np.save(os.path.join(temporary, f"{i:03d}.npy"), array)
+        try:
+            os.replace(temporary, path)
+        except OSError:
+            # Aynı girdiyi başka bir işlem önce yazdı
+            shutil.rmtree(temporary, ignore_errors=True)
+        self.evict()
+
+    def evict(self):
+        with self._lock:
+            entries = []
+            for name in os.listdir(self.directory):
+                path = os.path.join(self.directory, name)
+                if not os.path.isdir(path) or name.endswith(".tmp"):
+                    continue
+                if self._expired(path):
+                    shutil.rmtree(path, ignore_errors=True)
+                    continue
+                size = sum(os.path.getsize(os.path.join(path, filename)) for filename in os.listdir(path))
+                entries.append((os.path.getmtime(path), size, path))
+
+            if self.max_bytes is None:
+                return
+            total = sum(size for _, size, _ in entries)
+            for _, size, path in sorted(entries):
+                if total <= self.max_bytes:
+                    break
+                shutil.rmtree(path, ignore_errors=True)
+                total -= size
+
 
-    query = "SELECT student_id, success_rate FROM Table4;"
-    cursor.execute(query)
-    success_rates = cursor.fetchall()
+_matrix_cache = None
 
-    cursor.close()
-    conn.close()
 
-    return success_rates
+def configure_cache(directory=None, max_age=None, max_bytes=None):
+    global CACHE_DIR, CACHE_MAX_AGE, CACHE_MAX_BYTES, _matrix_cache
 
+    CACHE_DIR = directory
+    if max_age is not None:
+        CACHE_MAX_AGE = max_age
+    if max_bytes is not None:
+        CACHE_MAX_BYTES = max_bytes
+    _matrix_cache = None
+
+
+def get_matrix_cache():
+    global _matrix_cache
+
+    if CACHE_DIR is None:
+        return None
+    if _matrix_cache is None:
+        _matrix_cache = MatrixCache(CACHE_DIR, CACHE_MAX_AGE, CACHE_MAX_BYTES)
+    return _matrix_cache
+
+
+def cached_matrices(name, key_parts, compute):
+    cache = get_matrix_cache()
+    if cache is None:
+        return compute()
+
+    key = cache.key(*key_parts)
+    arrays = cache.load(name, key)
+    if arrays is None:
+        arrays = compute()
+        cache.store(name, key, arrays)
+    return arrays
+
+
+class IdIndex:
+    # Veritabanı kimliklerini (boşluklu ya da yeniden başlatılmış olabilir) 0..n-1 sıralarına eşler;
+    # matrisler ve sayfa düzeni kimliğe değil bu sıraya göre kurulur
+    def __init__(self, ids):
+        self.ids = list(ids)
+        self.positions = {key: i for i, key in enumerate(self.ids)}
+
+    def __len__(self):
+        return len(self.ids)
+
+    def __contains__(self, key):
+        return key in self.positions
+
+    def __getitem__(self, key):
+        return self.positions[key]
+
+    def get(self, key, default=None):
+        return self.positions.get(key, default)
+
+    def lookup(self, keys):
+        # Bilinmeyen kimlikler -1 olur
+        return np.array([self.positions.get(key, -1) for key in keys], dtype=np.int64)
+
+    def known(self, keys):
+        # Bilinen kimliklerin sıraları, artan sırada
+        return sorted(self.positions[key] for key in keys if key in self.positions)
+
+
+def configure_sparse_relations(mode=None, max_density=None, min_cells=None):
+    global SPARSE_RELATIONS, SPARSE_MAX_DENSITY, SPARSE_MIN_CELLS
+
+    if mode not in (None, "auto", "always", "never"):
+        raise ValueError(f"Unknown sparse relation mode: {mode}")
+    if mode is not None:
+        SPARSE_RELATIONS = mode
+    if max_density is not None:
+        SPARSE_MAX_DENSITY = max_density
+    if min_cells is not None:
+        SPARSE_MIN_CELLS = min_cells
+
+
+def use_sparse_relations(shape, nonzero):
+    # Küçük ya da yoğun matrislerde CSR'ın dolaylı erişimi yoğun diziden yavaştır
+    if sparse is None or SPARSE_RELATIONS == "never":
+        return False
+    if SPARSE_RELATIONS == "always":
+        return True
+    cells = shape[0] * shape[1]
+    return cells >= SPARSE_MIN_CELLS and nonzero <= cells * SPARSE_MAX_DENSITY
+
+
+class MatrixEngine:
+    def __init__(self, program_outcomes, course_outcomes, relations, evaluation_criteria, evaluation_relations,
+                 program_index=None, course_index=None, criteria_index=None):
+        # Eşlemeler anlık görüntüden gelirse aynı nesneler tüm tablo oluşturucularla paylaşılır
+        if program_index is None:
+            program_index = IdIndex(row[0] for row in program_outcomes)
+        if course_index is None:
+            course_index = IdIndex(row[0] for row in course_outcomes)
+        if criteria_index is None:
+            criteria_index = IdIndex(row[0] for row in evaluation_criteria)
+        self.program_index = program_index
+        self.course_index = course_index
+        self.criteria_index = criteria_index
+        self.program_ids = self.program_index.ids
+        self.course_ids = self.course_index.ids
+        self.criteria = self.criteria_index.ids
+        self.weights = np.array([row[1] for row in evaluation_criteria], dtype=float)
+
+        # Program çıktısı x ders çıktısı ilişki matrisi (Tablo 1); seyrekse CSR olarak tutulur
+        entries = {}
+        for program_outcome_id, course_outcome_id, relation_value in relations:
+            i = self.program_index.get(program_outcome_id)
+            j = self.course_index.get(course_outcome_id)
+            if i is not None and j is not None:
+                entries[i, j] = relation_value
+        entries = {key: value for key, value in entries.items() if value}
+        shape = (len(self.program_ids), len(self.course_ids))
+        rows = np.array([i for i, _ in entries], dtype=np.int64)
+        cols = np.array([j for _, j in entries], dtype=np.int64)
+        values = np.array(list(entries.values()), dtype=float)
+
+        self.sparse = use_sparse_relations(shape, len(entries))
+        self._dense_relations = None
+        if self.sparse:
+            self.relations = sparse.csr_matrix((values, (rows, cols)), shape=shape)
+            self._relation_key = (self.relations.data, self.relations.indices, self.relations.indptr,
+                                  np.array(shape))
+        else:
+            self.relations = np.zeros(shape)
+            self.relations[rows, cols] = values
+            self._relation_key = (self.relations,)
+
+        # Ders çıktısı x değerlendirme kriteri ilişki matrisi (Tablo 2)
+        self.evaluation = np.zeros((len(self.course_ids), len(self.criteria)))
+        for course_outcome_id, criteria, relation_value in evaluation_relations:
+            i = self.course_index.get(course_outcome_id)
+            j = self.criteria_index.get(criteria)
+            if i is not None and j is not None:
+                self.evaluation[i, j] = relation_value
+
+        # Ağırlıklı değerlendirme (Tablo 3)
+        self.weighted = self.evaluation * self.weights / 100
+        self.max_scores = self.weighted.sum(axis=1) * 100
+
+    def dense_relations(self):
+        # Sayfa yazıcıları her hücreyi yazdığından ilişki matrisinin yoğun halini kullanır
+        if not self.sparse:
+            return self.relations
+        if self._dense_relations is None:
+            self._dense_relations = self.relations.toarray()
+        return self._dense_relations
+
+    def relation_entries(self):
+        # Sıfır olmayan ilişkiler: (program çıktısı sırası, ders çıktısı sırası, değer)
+        if self.sparse:
+            entries = self.relations.tocoo()
+            return entries.row, entries.col, entries.data
+        rows, cols = np.nonzero(self.relations)
+        return rows, cols, self.relations[rows, cols]
+
+    def relation_averages(self):
+        if not self.course_ids:
+            return np.zeros(len(self.program_ids))
+        return np.asarray(self.relations.sum(axis=1)).ravel() / len(self.course_ids)
+
+    def evaluation_totals(self):
+        return self.evaluation.sum(axis=1)
+
+    def weighted_totals(self):
+        return self.weighted.sum(axis=1)
+
+    def student_scores(self, student_columns, student_data):
+        score_columns = IdIndex(student_columns).lookup(self.criteria)
+        student_data = np.asarray(student_data, dtype=float).reshape(len(student_data), len(student_columns))
+        student_ids = student_data[:, 0].astype(np.int64).tolist()
+        # Students tablosunda sütunu olmayan kriterin notu yoktur, boş not gibi 0 sayılır (-1 ile indekslenmez)
+        present = score_columns >= 0
+        scores = np.zeros((len(student_data), len(self.criteria)))
+        scores[:, present] = np.nan_to_num(student_data[:, score_columns[present]])
+        return student_ids, scores
+
+    def outcome_scores(self, scores):
+        return cached_matrices("outcome_scores", (self.weighted, scores), partial(self._outcome_scores, scores))
+
+    def _outcome_scores(self, scores):
+        # öğrenci x ders çıktısı x kriter ağırlıklı puanlar (Tablo 4)
+        weighted_scores = scores[:, None, :] * self.weighted[None, :, :]
+        totals = scores @ self.weighted.T
+        success_rates = np.divide(totals * 100, self.max_scores, out=np.zeros_like(totals),
+                                  where=self.max_scores > 0)
+        return weighted_scores, totals, success_rates
+
+    def index_success_rates(self, student_index, success_rates):
+        # Table4 satırlarını tek geçişte öğrenci x ders çıktısı matrisine yerleştir
+        if not isinstance(student_index, IdIndex):
+            student_index = IdIndex(student_index)
+        matrix = np.zeros((len(student_index), len(self.course_ids)))
+        for student_id, course_outcome_id, success_rate in success_rates:
+            i = student_index.get(student_id)
+            j = self.course_index.get(course_outcome_id)
+            if i is not None and j is not None:
+                matrix[i, j] = success_rate
+        return matrix
+
+    def attainment(self, success_rates):
+        return cached_matrices("attainment", (*self._relation_key, success_rates),
+                               partial(self._attainment, success_rates))
+
+    def attainment_ratios(self, success_rates):
+        # Sadece oranlar gerektiğinde (ör. dışa aktarma) öğrenci x PO x CO katkı dizisi hiç oluşturulmaz
+        ratios, = cached_matrices("attainment_ratios", (*self._relation_key, success_rates),
+                                  partial(self._attainment_ratios, success_rates))
+        return ratios
+
+    def _attainment(self, success_rates):
+        # öğrenci x program çıktısı x ders çıktısı katkıları (Tablo 5)
+        values = self.dense_relations()[None, :, :] * success_rates[:, None, :]
+        if self.sparse:
+            ratios, = self._attainment_ratios(success_rates)
+            return values, ratios
+        course_count = len(self.course_ids)
+        avg_success = values.sum(axis=2) / course_count if course_count else np.zeros(values.shape[:2])
+        return values, self._ratios(avg_success)
+
+    def _attainment_ratios(self, success_rates):
+        course_count = len(self.course_ids)
+        if not course_count:
+            return self._ratios(np.zeros((len(success_rates), len(self.program_ids)))),
+        # CSR x yoğun çarpım: sadece sıfır olmayan ilişkiler gezilir
+        avg_success = np.asarray(self.relations @ success_rates.T).T / course_count
+        return self._ratios(avg_success),
+
+    def _ratios(self, avg_success):
+        avg_relation = self.relation_averages()
+        return np.divide(avg_success, avg_relation, out=np.zeros_like(avg_success), where=avg_relation != 0)
+
+
+class ScoreStore:
+    # Öğrenci notlarının sütun bazlı kopyası: her kriter için diskte bir float32 dizisi
+    def __init__(self, directory, criteria, change_id, student_ids, columns):
+        self.directory = directory
+        self.criteria = criteria
+        self.change_id = change_id
+        self.student_ids = student_ids
+        self.columns = columns
+        self._student_index = None
+
+    def __len__(self):
+        return len(self.student_ids)
+
+    @classmethod
+    def open(cls, directory):
+        try:
+            with open(os.path.join(directory, "store.json"), encoding="utf-8") as file:
+                meta = json.load(file)
+        except (OSError, ValueError):
+            return None
+        if meta.get("version") != SCORE_STORE_VERSION:
+            return None
+
+        student_ids = np.load(os.path.join(directory, "student_ids.npy"), mmap_mode="r")
+        columns = {criteria: np.load(os.path.join(directory, f"score_{i:03d}.npy"), mmap_mode="r")
+                   for i, criteria in enumerate(meta["criteria"])}
+        return cls(directory, meta["criteria"], meta["change_id"], student_ids, columns)
+
+    @classmethod
+    def build(cls, directory, cursor, criteria, change_id, chunk_size=None):
+        chunk_size = chunk_size or SCORE_CHUNK_SIZE
+        cursor.execute(*student_count_query())
+        count = cursor.fetchone()[0]
+
+        # Yeni kopyayı yan dizine yaz, bitince eskisinin yerine koy
+        temporary = f"{directory}.{os.getpid()}.tmp"
+        shutil.rmtree(temporary, ignore_errors=True)
+        os.makedirs(temporary)
+        student_ids = np.lib.format.open_memmap(os.path.join(temporary, "student_ids.npy"), mode="w+",
+                                                dtype=np.int64, shape=(count,))
+        columns = [np.lib.format.open_memmap(os.path.join(temporary, f"score_{i:03d}.npy"), mode="w+",
+                                             dtype=np.float32, shape=(count,))
+                   for i in range(len(criteria))]
+
+        cursor.execute(*student_scores_query(criteria))
+        start = 0
+        while start < count:
+            rows = cursor.fetchmany(chunk_size)
+            if not rows:
+                break
+            chunk = np.array([tuple(row) for row in rows], dtype=float).reshape(len(rows), len(criteria) + 1)
+            student_ids[start:start + len(rows)] = chunk[:, 0]
+            for i, column in enumerate(columns):
+                # Boş notlar NaN olarak kalır; hesaplamalar 0, notlar sayfası boş hücre kullanır
+                column[start:start + len(rows)] = chunk[:, i + 1]
+            start += len(rows)
+
+        for array in (student_ids, *columns):
+            array.flush()
+        del student_ids, columns
+        with open(os.path.join(temporary, "store.json"), "w", encoding="utf-8") as file:
+            json.dump({"version": SCORE_STORE_VERSION, "criteria": list(criteria), "change_id": change_id,
+                       "count": count}, file)
+
+        # Sadece kopyanın kendi dizini silinir; store.json'u olmayan dolu bir dizin başkasınındır
+        if os.path.isdir(directory) and os.listdir(directory) and \
+                not os.path.exists(os.path.join(directory, "store.json")):
+            shutil.rmtree(temporary, ignore_errors=True)
+            raise RuntimeError(f"{directory} is not empty and is not a score store, refusing to replace it.")
+        shutil.rmtree(directory, ignore_errors=True)
+        os.replace(temporary, directory)
+        return cls.open(directory)
+
+    def student_index(self):
+        if self._student_index is None:
+            self._student_index = IdIndex(self.student_ids.tolist())
+        return self._student_index
+
+    def raw_matrix(self, criteria, indices=None):
+        # Boş notlar NaN olarak döner
+        selection = slice(None) if indices is None else indices
+        count = len(self.student_ids[selection])
+        if len(criteria) == 0:
+            return np.zeros((count, 0))
+        # Kopyada olmayan kriterlerin notu yoktur, boş sayılır
+        return np.column_stack([np.asarray(self.columns[criterion][selection], dtype=float)
+                                if criterion in self.columns else np.full(count, np.nan)
+                                for criterion in criteria])
+
+    def matrix(self, criteria, indices=None):
+        # Hesaplamalarda boş not 0 sayılır
+        return np.nan_to_num(self.raw_matrix(criteria, indices))
+
+    def iter_chunks(self, criteria, chunk_size=None):
+        # Boş notlar NaN olarak döner
+        chunk_size = chunk_size or SCORE_CHUNK_SIZE
+        for start in range(0, len(self.student_ids), chunk_size):
+            selection = slice(start, start + chunk_size)
+            yield self.student_ids[selection].tolist(), self.raw_matrix(criteria, selection)
+
+
+def score_store_path():
+    # Her dersin notları --score-store dizininin altında kendi alt dizininde tutulur; yenilenirken sadece
+    # bu alt dizin değiştirilir, verilen dizindeki diğer dosyalara dokunulmaz
+    return os.path.join(SCORE_STORE_DIR, current_course())
+
+
+def open_score_store(cursor, change_id):
+    # Sütunlar Students tablosundaki sırayla tutulur, notlar sayfası da bu sırayı kullanır
+    if STUDENT_SCHEMA == "long":
+        cursor.execute("SELECT Criteria FROM EvaluationCriteria;")
+        criteria = [row[0] for row in cursor.fetchall()]
+    else:
+        criteria = wide_student_criteria(cursor)
+    directory = score_store_path()
+    store = ScoreStore.open(directory)
+
+    # Kopya, son oluşturulmasından beri bu dersin notlarında veya kriterlerde değişiklik yoksa geçerlidir
+    stale = store is None or change_id is None or store.change_id is None or store.criteria != criteria
+    if not stale:
+        cursor.execute("SELECT COUNT(*) FROM ChangeLog WHERE id > ? AND Entity IN ('Student', 'EvaluationCriteria') "
+                       "AND Course IN (?, '*');", (store.change_id, current_course()))
+        stale = cursor.fetchone()[0] > 0
+    if stale:
+        store = ScoreStore.build(directory, cursor, criteria, change_id)
+    return store
+
+
+def configure_score_store(directory=None, chunk_size=None):
+    global SCORE_STORE_DIR, SCORE_CHUNK_SIZE
+
+    SCORE_STORE_DIR = directory
+    if chunk_size is not None:
+        SCORE_CHUNK_SIZE = chunk_size
+
+
+class Snapshot:
+    def __init__(self, program_outcomes, course_outcomes, relations, evaluation_criteria, evaluation_relations,
+                 student_columns, students, change_id=None, score_store=None):
+        self.change_id = change_id
+        self.program_outcomes = program_outcomes
+        self.course_outcomes = course_outcomes
+        self.relations = relations
+        self.evaluation_criteria = evaluation_criteria
+        self.evaluation_relations = evaluation_relations
+        self.student_columns = student_columns
+        self.students = students
+        self.score_store = score_store
+
+        # Kimlik -> sıra eşlemeleri anlık görüntü başına bir kez kurulur, motor ve tüm tablolar bunları kullanır
+        self.program_index = IdIndex(row[0] for row in program_outcomes)
+        self.course_index = IdIndex(row[0] for row in course_outcomes)
+        self.criteria_index = IdIndex(row[0] for row in evaluation_criteria)
+        self.engine = MatrixEngine(program_outcomes, course_outcomes, relations, evaluation_criteria,
+                                   evaluation_relations, self.program_index, self.course_index, self.criteria_index)
+        self._student_index = None
+        self._scores = None
+        if score_store is not None:
+            self.student_columns = ["Student", *score_store.criteria]
+            self.student_ids = score_store.student_ids.tolist()
+        elif len(students):
+            self.student_ids, self._scores = self.engine.student_scores(student_columns, students)
+        else:
+            self.student_ids, self._scores = [], np.zeros((0, len(self.engine.criteria)))
 
-def create_table1():
+    @property
+    def student_index(self):
+        if self._student_index is None:
+            if self.score_store is not None:
+                self._student_index = self.score_store.student_index()
+            else:
+                self._student_index = IdIndex(self.student_ids)
+        return self._student_index
+
+    @property
+    def scores(self):
+        if self._scores is None:
+            self._scores = self.score_store.matrix(self.engine.criteria)
+        return self._scores
+
+    def student_scores(self, indices):
+        if self._scores is None:
+            return self.score_store.matrix(self.engine.criteria, indices)
+        return self._scores[indices]
+
+    def raw_scores(self, indices):
+        # student_scores gibi, ama girilmemiş notlar 0 yerine NaN
+        if self.score_store is not None:
+            return self.score_store.raw_matrix(self.engine.criteria, indices)
+        rows = self.students[indices]
+        columns = IdIndex(self.student_columns).lookup(self.engine.criteria)
+        present = columns >= 0
+        scores = np.full((len(rows), len(columns)), np.nan)
+        scores[:, present] = rows[:, columns[present]]
+        return scores
+
+    def student_rows(self):
+        if self.score_store is None:
+            for start in range(0, len(self.students), SCORE_CHUNK_SIZE):
+                for row in self.students[start:start + SCORE_CHUNK_SIZE].tolist():
+                    yield (int(row[0]), *(None if value != value else value for value in row[1:]))
+            return
+
+        for student_ids, scores in self.score_store.iter_chunks(self.score_store.criteria):
+            for student_id, row in zip(student_ids, scores.tolist()):
+                # float32 değerleri girildikleri ondalık haliyle göster
+                yield (student_id, *(None if value != value else float(f"{value:.7g}") for value in row))
+
+
+@instrumented
+def load_snapshot(evaluation_criteria=None, students=True):
+    # Bir rapor çalıştırması için geçerli dersin tablolarını tek bağlantıyla, her tabloyu bir kez oku.
+    # Toplu çalıştırmada ortak kriterler bir kez okunup her derse verilir.
+    # students=False: notlar okunmaz (veritabanında hesaplanan tablolar için yalnızca çıktılar ve kriterler gerekir)
+    backend = get_backend()
+    course = current_course()
+
+    with pooled_connection("RelationMatrix") as conn:
+        cursor = conn.cursor()
+
+        # Anlık görüntünün hangi değişikliğe kadar güncel olduğunu, diğer okumalardan önce kaydet
+        change_id = None
+        if backend.table_exists(cursor, "ChangeLog"):
+            cursor.execute("SELECT COALESCE(MAX(id), 0) FROM ChangeLog;")
+            change_id = cursor.fetchone()[0]
+
+        cursor.execute("SELECT id, data FROM ProgramOutcomes WHERE Program = ?;", (course_program(cursor, course),))
+        program_outcomes = cursor.fetchall()
+
+        cursor.execute("SELECT id, data FROM CourseOutcomes WHERE Course = ?;", (course,))
+        course_outcomes = cursor.fetchall()
+
+        cursor.execute(f"SELECT ProgramOutcomeID, CourseOutcomeID, RelationValue FROM ProgramCourseRelations "
+                       f"WHERE CourseOutcomeID IN ({COURSE_OUTCOME_IDS});", (course,))
+        relations = cursor.fetchall()
+
+        if evaluation_criteria is None:
+            cursor.execute("SELECT Criteria, Weight FROM EvaluationCriteria;")
+            evaluation_criteria = cursor.fetchall()
+
+        cursor.execute(f"SELECT CourseOutcomeID, Criteria, RelationValue FROM CourseEvaluationRelations "
+                       f"WHERE CourseOutcomeID IN ({COURSE_OUTCOME_IDS});", (course,))
+        evaluation_relations = cursor.fetchall()
+
+        student_columns, student_rows, score_store = [], [], None
+        if students and backend.table_exists(cursor, student_table()):
+            if SCORE_STORE_DIR is not None:
+                score_store = open_score_store(cursor, change_id)
+            else:
+                if STUDENT_SCHEMA == "long":
+                    criteria = [row[0] for row in evaluation_criteria]
+                else:
+                    criteria = wide_student_criteria(cursor)
+                cursor.execute(*student_scores_query(criteria))
+                student_columns = ["Student", *criteria]
+                # Satır nesnelerini biriktirmeden her parçayı doğrudan sayısal diziye çevir
+                chunks = [np.array([tuple(row) for row in rows], dtype=float)
+                          for rows in iter_row_chunks(cursor)]
+                student_rows = np.concatenate(chunks) if chunks else np.zeros((0, len(student_columns)))
+
+    return Snapshot(program_outcomes, course_outcomes, relations, evaluation_criteria, evaluation_relations,
+                    student_columns, student_rows, change_id, score_store)
+
+
+@instrumented
+def create_table1(snapshot=None, formulas=False):
     workbook = Workbook()
     sheet = workbook.active
 
-    program_outcomes = fetch_table_data("ProgramOutcomes")
-    course_outcomes = fetch_table_data("CourseOutcomes")
+    snapshot = snapshot or load_snapshot()
+    program_outcomes = snapshot.program_outcomes
+    course_outcomes = snapshot.course_outcomes
+    relations = snapshot.relations
+    engine = snapshot.engine
 
-    program_row_count = len(program_outcomes)
     course_row_count = len(course_outcomes)
 
     sheet.merge_cells('A1:B1')
@@ -224,35 +1680,46 @@ def create_table1():
         comment = Comment(program_text, "Database")
         cell.comment = comment
 
-    course_outcomes = fetch_table_data("CourseOutcomes")
     for j, (course_id, course_text) in enumerate(course_outcomes, start=1):
         c = sheet.cell(row=2, column=j + 2)
         c.value = course_id
         comment = Comment(course_text, "Database")
         c.comment = comment
 
-    relations = fetch_relations()
-    for relation in relations:
-        program_outcome_id, course_outcome_id, relation_value = relation
-        row = program_outcome_id + 2
-        col = course_outcome_id + 2
-        sheet.cell(row=row, column=col, value=relation_value)
-
-    for i in range(3, program_row_count + 3):
-        total = sum(sheet.cell(row=i, column=j).value or 0 for j in range(3, course_row_count + 3))
-        result = round((total / course_row_count), 2)
-        sheet.cell(row=i, column=course_row_count + 3, value=result)
+    if formulas:
+        # Boş ilişkiler 0 yazılır ki elle düzenlenen hücreler de ortalamaya katılsın
+        for row, relation_row in enumerate(engine.dense_relations().tolist(), start=3):
+            for col, relation_value in enumerate(relation_row, start=3):
+                sheet.cell(row=row, column=col, value=relation_value)
+    else:
+        for program_outcome_id, course_outcome_id, relation_value in relations:
+            row = snapshot.program_index.get(program_outcome_id)
+            col = snapshot.course_index.get(course_outcome_id)
+            if row is not None and col is not None:
+                sheet.cell(row=row + 3, column=col + 3, value=relation_value)
+
+    for i, average in enumerate(engine.relation_averages().tolist(), start=3):
+        if formulas and course_row_count:
+            value = f"=ROUND(AVERAGE(C{i}:{get_column_letter(course_row_count + 2)}{i}),2)"
+        else:
+            value = round(average, 2)
+        sheet.cell(row=i, column=course_row_count + 3, value=value)
 
     sheet.cell(row=2, column=course_row_count + 3, value="Rel Value")
 
-    workbook.save(filename="table1.xlsx")
+    save_workbook(workbook, report_path("table1.xlsx"))
 
 
-def create_table2():
+@instrumented
+def create_table2(snapshot=None, formulas=False):
     workbook = Workbook()
     sheet = workbook.active
 
-    course_outcomes = fetch_table_data("CourseOutcomes")
+    snapshot = snapshot or load_snapshot()
+    course_outcomes = snapshot.course_outcomes
+    criteria_data = snapshot.evaluation_criteria
+    relations = snapshot.evaluation_relations
+    engine = snapshot.engine
 
     sheet.merge_cells('A1:B1')
     sheet['A1'] = "Table 2"
@@ -267,44 +1734,30 @@ def create_table2():
         comment = Comment(program_text, "Database")
         cell.comment = comment
 
-    criteria_data = fetch_evaluation_data()
     for index, (criteria, weight) in enumerate(criteria_data, start=3):
         sheet.cell(row=1, column=index, value=weight)
         sheet.cell(row=2, column=index, value=criteria)
 
-        relations = fetch_evaluation_relations()
-    for relation in relations:
-        course_outcome_id, criteria, relation_value = relation
-
-        # CourseOutcomeID'ye göre satır bulunması
-        row = None
-        for i, (course_id, _) in enumerate(course_outcomes, start=3):
-            if course_outcome_id == course_id:
-                row = i
-                break
+    for course_outcome_id, criteria, relation_value in relations:
+        row = snapshot.course_index.get(course_outcome_id)
+        col = snapshot.criteria_index.get(criteria)
+        if row is not None and col is not None:
+            sheet.cell(row=row + 3, column=col + 3, value=relation_value)
 
-        # Criteria'ya göre sütun bulunması
-        col = None
-        for j, (criterion, _) in enumerate(criteria_data, start=3):
-            if criteria == criterion:
-                col = j
-                break
-
-        # Değeri tabloya yazdırma
-        if row and col:
-            sheet.cell(row=row, column=col, value=relation_value)
-
-    # Her satır için toplam hesaplama
+    # Her satır için toplam
     total_col = len(criteria_data) + 3
     sheet.cell(row=2, column=total_col, value="Total")
-    for row_idx in range(3, len(course_outcomes) + 3):
-        total = sum(sheet.cell(row=row_idx, column=col_idx).value or 0 for col_idx in range(3, total_col))
+    last_col = get_column_letter(total_col - 1)
+    for row_idx, total in enumerate(engine.evaluation_totals().tolist(), start=3):
+        if formulas and criteria_data:
+            total = f"=SUM(C{row_idx}:{last_col}{row_idx})"
         sheet.cell(row=row_idx, column=total_col, value=total)
 
-    workbook.save(filename="table2.xlsx")
+    save_workbook(workbook, report_path("table2.xlsx"))
 
 
-def create_table3():
+@instrumented
+def create_table3(snapshot=None):
     workbook = Workbook()
     sheet = workbook.active
 
@@ -315,29 +1768,18 @@ def create_table3():
     sheet.merge_cells('A2:B2')
     sheet['A2'] = "Course Outcomes"
 
-    evaluation_criteria = fetch_evaluation_data()
-    criteria_weights = {criteria: weight for criteria, weight in evaluation_criteria}
-    criteria_headers = list(criteria_weights.keys())
+    snapshot = snapshot or load_snapshot()
+    course_outcomes = snapshot.course_outcomes
+    engine = snapshot.engine
 
-    for col, criteria in enumerate(criteria_headers, start=3):
+    for col, criteria in enumerate(engine.criteria, start=3):
         sheet.cell(row=2, column=col, value=criteria)
 
-    total_col = len(criteria_headers) + 3
+    total_col = len(engine.criteria) + 3
     sheet.cell(row=2, column=total_col, value="Total")
 
-    course_evaluation_relations = fetch_evaluation_relations()
-    course_outcomes = fetch_table_data("CourseOutcomes")
-
-    weighted_data = {}
-    for course_outcome_id, criteria, relation_value in course_evaluation_relations:
-        weight = criteria_weights.get(criteria, 0)
-        weighted_value = (relation_value * weight) / 100
-
-        if course_outcome_id not in weighted_data:
-            weighted_data[course_outcome_id] = {}
-
-        weighted_data[course_outcome_id][criteria] = weighted_value
-
+    weighted_rows = engine.weighted.tolist()
+    totals = engine.weighted_totals().tolist()
     for row_idx, (course_outcome_id, program_text) in enumerate(course_outcomes, start=3):
         sheet.merge_cells(start_row=row_idx, start_column=1, end_row=row_idx, end_column=2)
         cell = sheet.cell(row=row_idx, column=1, value=course_outcome_id)
@@ -345,99 +1787,164 @@ def create_table3():
         comment = Comment(program_text, "Database")
         cell.comment = comment
 
-        total = 0
-        for col_idx, criteria in enumerate(criteria_headers, start=3):
-            value = weighted_data.get(course_outcome_id, {}).get(criteria, 0)
+        for col_idx, value in enumerate(weighted_rows[row_idx - 3], start=3):
             sheet.cell(row=row_idx, column=col_idx, value=value)
-            total += value
-
-        sheet.cell(row=row_idx, column=total_col, value=total)
 
-    workbook.save("table3.xlsx")
+        sheet.cell(row=row_idx, column=total_col, value=totals[row_idx - 3])
 
+    save_workbook(workbook, report_path("table3.xlsx"))
 
-def save_table3_to_database():
-    evaluation_criteria = fetch_evaluation_data()
-    criteria_weights = {criteria: weight for criteria, weight in evaluation_criteria}
-    course_evaluation_relations = fetch_evaluation_relations()
-    course_outcomes = fetch_table_data("CourseOutcomes")
 
-    weighted_data = {}
-    for course_outcome_id, criteria, relation_value in course_evaluation_relations:
-        weight = criteria_weights.get(criteria, 0)
-        weighted_value = (relation_value * weight) / 100
+def table3_rows(engine, outcome_indices=None):
+    if outcome_indices is None:
+        outcome_indices = range(len(engine.course_ids))
 
-        if course_outcome_id not in weighted_data:
-            weighted_data[course_outcome_id] = {}
+    totals = engine.weighted_totals().tolist()
+    weighted = engine.weighted.tolist()
+    for o in outcome_indices:
+        yield (engine.course_ids[o], totals[o], *weighted[o])
 
-        weighted_data[course_outcome_id][criteria] = weighted_value
 
-    conn = get_connection("RelationMatrix")
-    cursor = conn.cursor()
-
-    cursor.execute("SELECT * FROM INFORMATION_SCHEMA.TABLES WHERE TABLE_NAME = 'Table3';")
-    existing_table = cursor.fetchone()
-
-    if existing_table:
-        cursor.execute("DROP TABLE Table3;")
-
-    criteria_columns = ", ".join(f'"{criteria}" FLOAT' for criteria in criteria_weights.keys())
-    cursor.execute(f"""CREATE TABLE Table3 (id INT IDENTITY(1,1) PRIMARY KEY,course_outcome_id 
-                   INT NOT NULL,total_score FLOAT NOT NULL,{criteria_columns},)""")
-
-    for course_outcome_id, program_text in course_outcomes:
-        total_score = 0
-        criteria_values = []
-
-        for criteria in criteria_weights.keys():
-            value = weighted_data.get(course_outcome_id, {}).get(criteria, 0)
-            criteria_values.append(value)
-            total_score += value
-
-        columns = ", ".join(f'"{criteria}"' for criteria in criteria_weights.keys())
-        placeholders = ", ".join("?" for _ in criteria_values)
-
-        cursor.execute(f"""INSERT INTO Table3 (course_outcome_id, total_score, {columns})
-            VALUES (?, ?, {placeholders})""", (course_outcome_id, total_score, *criteria_values))
+def weighted_evaluation_query(criteria, outcome_ids=()):
+    # Tablo 3'ün SQL karşılığı: geçerli dersin çıktıları için ilişki değeri * ağırlık / 100 (SQL Server ve SQLite)
+    weighted = "CAST(r.RelationValue * c.Weight AS FLOAT) / 100"
+    columns = ",\n               ".join(
+        f'COALESCE(SUM(CASE WHEN r.Criteria = ? THEN {weighted} END), 0) AS "{criterion}"' for criterion in criteria
+    )
+    query = f"""
+        SELECT o.id AS course_outcome_id,
+               COALESCE(SUM({weighted}), 0) AS total_score,
+               {columns}
+        FROM CourseOutcomes o
+        LEFT JOIN CourseEvaluationRelations r ON r.CourseOutcomeID = o.id
+        LEFT JOIN EvaluationCriteria c ON c.Criteria = r.Criteria
+        WHERE o.Course = ?"""
+    params = [*criteria, current_course()]
+    if outcome_ids:
+        condition, outcome_params = in_list("o.id", outcome_ids)
+        query += f" AND {condition}"
+        params += outcome_params
+    return query + "\n        GROUP BY o.id", params
+
+
+def outcome_scores_query(criteria, available=None):
+    # Tablo 4'ün SQL karşılığı: her öğrenci ve ders çıktısı için ağırlıklı puanlar ve başarı oranı
+    weighted_query, weighted_params = weighted_evaluation_query(criteria)
+    students_query, students_params = student_scores_query(criteria, available)
+    products = [f'COALESCE(s.[{criterion}], 0) * w."{criterion}"' for criterion in criteria]
+    total = " + ".join(products)
+    query = f"""
+        SELECT s.Student, w.course_outcome_id, {total}, {", ".join(products)}, w.total_score * 100,
+               CASE WHEN w.total_score > 0 THEN ROUND(({total}) * 100 / (w.total_score * 100), 2) ELSE 0 END
+        FROM ({students_query}) s
+        CROSS JOIN ({weighted_query}) w"""
+    return query, students_params + weighted_params
+
+
+def in_list(column, values):
+    return f"{column} IN ({', '.join('?' for _ in values)})", list(values)
+
+
+def changed_keys(changes, *entities):
+    return {key for entity in entities for key in changes.get(entity, ())}
+
+
+def reset_report_table(cursor, table_name, columns, create_query):
+    # Tablo tüm derslerin satırlarını tutar; yapı aynıysa sadece geçerli dersin satırları silinir
+    backend = get_backend()
+    if backend.table_exists(cursor, table_name) and backend.column_names(cursor, table_name) == columns:
+        cursor.execute(f"DELETE FROM {table_name} WHERE course_outcome_id IN ({COURSE_OUTCOME_IDS});",
+                       (current_course(),))
+        return
 
-    conn.commit()
-    conn.close()
+    backend.drop_table_if_exists(cursor, table_name)
+    cursor.execute(create_query)
+    # Diğer derslerin satırları da silindi, onların artımlı çalıştırmaları tam hesaplamaya düşmeli
+    cursor.execute("DELETE FROM Materializations WHERE TableName = ?", (table_name,))
+
+
+@instrumented
+def save_table3_to_database(snapshot=None, batch_size=None, incremental=False, set_based=False):
+    snapshot = snapshot or load_snapshot(students=not set_based)
+    engine = snapshot.engine
+
+    columns = ", ".join(f'"{criteria}"' for criteria in engine.criteria)
+    placeholders = ", ".join("?" for _ in engine.criteria)
+    insert_query = f"""INSERT INTO Table3 (course_outcome_id, total_score, {columns})
+            VALUES (?, ?, {placeholders})"""
+    # set_based: satırlar veritabanında tek bir INSERT ... SELECT ile hesaplanır, veri sunucudan çıkmaz
+    select_query, select_params = weighted_evaluation_query(engine.criteria)
+    insert_select = f"INSERT INTO Table3 (course_outcome_id, total_score, {columns}) {select_query}"
+
+    with pooled_connection("RelationMatrix") as conn:
+        cursor = conn.cursor()
+        backend = get_backend()
+
+        changes = read_changes(cursor, "Table3", snapshot.change_id) if incremental else None
+        full_rebuild = (
+            changes is None
+            or not backend.table_exists(cursor, "Table3")
+            or "EvaluationCriteria" in changes
+            or "*" in changed_keys(changes, "CourseOutcome", "CourseEvaluationRelation")
+        )
+
+        if full_rebuild:
+            criteria_columns = ", ".join(f'"{criteria}" FLOAT' for criteria in engine.criteria)
+            reset_report_table(cursor, "Table3", ["id", "course_outcome_id", "total_score", *engine.criteria],
+                               f"""CREATE TABLE Table3 (id {backend.identity_column},course_outcome_id 
+                           INT NOT NULL,total_score FLOAT NOT NULL,{criteria_columns})""")
+
+            if set_based:
+                cursor.execute(insert_select, select_params)
+            else:
+                bulk_insert(cursor, insert_query, table3_rows(engine), batch_size)
+        else:
+            # Sadece değişen ders çıktılarının satırlarını yeniden hesapla
+            outcome_ids = {int(key) for key in changed_keys(changes, "CourseOutcome", "CourseEvaluationRelation")}
+            if outcome_ids:
+                cursor.executemany("DELETE FROM Table3 WHERE course_outcome_id = ?",
+                                   [(outcome_id,) for outcome_id in outcome_ids])
+            outcome_indices = engine.course_index.known(outcome_ids)
+            if set_based and outcome_indices:
+                outcome_query, outcome_params = weighted_evaluation_query(
+                    engine.criteria, [engine.course_ids[o] for o in outcome_indices])
+                cursor.execute(f"INSERT INTO Table3 (course_outcome_id, total_score, {columns}) {outcome_query}",
+                               outcome_params)
+            elif not set_based:
+                bulk_insert(cursor, insert_query, table3_rows(engine, outcome_indices), batch_size)
+
+        record_materialization(cursor, "Table3", snapshot.change_id)
+        conn.commit()
 
 
-def create_notes():
+@instrumented
+def create_notes(snapshot=None):
+    snapshot = snapshot or load_snapshot()
     workbook = Workbook()
     sheet = workbook.active
 
-    conn = get_connection("RelationMatrix")
-    cursor = conn.cursor()
-
     sheet.merge_cells('A1:B1')
     sheet['A1'] = "Table Note"
     sheet['C1'] = "Notes"
 
-    cursor.execute("SELECT COLUMN_NAME FROM INFORMATION_SCHEMA.COLUMNS WHERE TABLE_NAME = 'Students';")
-    columns = [row[0] for row in cursor.fetchall()]
+    columns = snapshot.student_columns
 
     if not columns:
         print("Students table is empty or does not exist.")
         return
 
-    cursor.execute("SELECT * FROM Students;")
-    rows = cursor.fetchall()
-
-    if not rows:
+    if not snapshot.student_ids:
         print("No data found in Students table.")
         return
 
-    cursor.execute("SELECT Criteria, Weight FROM EvaluationCriteria;")
-    criteria_weights = {row[0]: row[1] for row in cursor.fetchall()}
+    criteria_weights = {criteria: weight for criteria, weight in snapshot.evaluation_criteria}
 
     for col_idx, column_name in enumerate(columns, start=1):
         sheet.cell(row=2, column=col_idx + 1, value=column_name)
 
     sheet.cell(row=2, column=len(columns) + 2, value="Average")
 
-    for row_idx, row in enumerate(rows, start=3):
+    for row_idx, row in enumerate(snapshot.student_rows(), start=3):
         total_score = 0
         weight_sum = 0
 
@@ -447,6 +1954,9 @@ def create_notes():
         for col_idx, value in enumerate(row[1:], start=2):
             sheet.cell(row=row_idx, column=col_idx + 1, value=value)
 
+            # Boş not ortalamaya girmez, ağırlığı da paydaya eklenmez
+            if value is None:
+                continue
             criterion = columns[col_idx - 1]
             weight = criteria_weights.get(criterion, 0)
             total_score += value * weight
@@ -455,233 +1965,501 @@ def create_notes():
         average = total_score / weight_sum if weight_sum > 0 else 0
         sheet.cell(row=row_idx, column=len(columns) + 2, value=round(average, 2))
 
-    workbook.save("notlar.xlsx")
-    conn.close()
+    save_workbook(workbook, report_path("notlar.xlsx"))
 
 
-def create_table4():
-    conn = get_connection("RelationMatrix")
-    cursor = conn.cursor()
+def add_report_sheet(workbook, title):
+    if not workbook.write_only and len(workbook.worksheets) == 1 and workbook.active.title == "Sheet":
+        sheet = workbook.active
+        sheet.title = title
+        return sheet
+    return workbook.create_sheet(title=title)
 
-    cursor.execute("SELECT Criteria, Weight FROM EvaluationCriteria;")
-    evaluation_weights = {row[0]: row[1] for row in cursor.fetchall()}
 
-    cursor.execute("SELECT * FROM Students;")
-    student_columns = [column[0] for column in cursor.description]
-    student_data = cursor.fetchall()
+def merge_report_cells(sheet, cell_range):
+    if sheet.parent.write_only:
+        sheet.merged_cells.add(cell_range)
+    else:
+        sheet.merge_cells(cell_range)
 
-    cursor.execute("SELECT id, data FROM CourseOutcomes;")
-    course_outcomes = cursor.fetchall()
 
-    cursor.execute("SELECT CourseOutcomeID, Criteria, RelationValue FROM CourseEvaluationRelations;")
-    course_evaluation_relations = cursor.fetchall()
+def comment_cell(sheet, value, text, author):
+    cell = WriteOnlyCell(sheet, value=value)
+    cell.comment = Comment(text, author)
+    return cell
 
-    conn.close()
 
-    weighted_values = {}
-    for outcome_id, criteria, relation_value in course_evaluation_relations:
-        weight = evaluation_weights.get(criteria, 0)
-        if outcome_id not in weighted_values:
-            weighted_values[outcome_id] = {}
-        weighted_values[outcome_id][criteria] = relation_value * (weight / 100)
+def append_report_row(sheet, row):
+    # write-only modda openpyxl, satırdaki bir Cell nesnesinden sonraki değerleri aynı hücreye yazıyor;
+    # yorumlu satırlardaki tüm değerleri ayrı hücrelere çevir
+    if sheet.parent.write_only and any(isinstance(value, Cell) for value in row):
+        row = [value if value is None or isinstance(value, Cell) else WriteOnlyCell(sheet, value=value)
+               for value in row]
+    if sheet.parent.write_only and active_stages():
+        count_metric("cells_written", sum(1 for value in row if value is not None))
+    sheet.append(row)
 
-    workbook = Workbook()
-    sheet_created = False
 
-    for student in student_data:
-        if not sheet_created:
-            sheet = workbook.active
-            sheet.title = f"Student {student[0]}"
-            sheet_created = True
-        else:
-            sheet = workbook.create_sheet(title=f"Student {student[0]}")
+def finish_report_sheet(sheet):
+    # write-only sayfayı diske yaz ve dosyasını kapat, bellekte satır tutulmaz
+    if sheet.parent.write_only:
+        sheet.close()
 
-        sheet.merge_cells("A1:B1")
-        sheet["A1"] = "Table 4"
 
-        sheet.merge_cells("C1:D1")
-        sheet["C1"] = f"Student {student[0]}"
+def write_report_workbook(write_sheet, context, students, filename, stream=False):
+    # students: (öğrenci no, sayfa değerleri...) üreten bir dizi; sayfalar hesaplandıkça yazılır
+    workbook = Workbook(write_only=stream)
+    for student_id, *values in students:
+        write_sheet(workbook, context, student_id, *values)
+    save_workbook(workbook, filename)
+    return filename
 
-        sheet.merge_cells("A2:B2")
-        sheet["A2"] = "Program Outcomes"
 
-        headers = [*evaluation_weights.keys(), "Total", "Max", "% Success"]
-        for col_index, header in enumerate(headers, start=3):
-            sheet.cell(row=2, column=col_index, value=header)
+def student_chunks(student_count, chunk_size=None):
+    chunk_size = chunk_size or SCORE_CHUNK_SIZE
+    for start in range(0, student_count, chunk_size):
+        yield slice(start, min(start + chunk_size, student_count))
 
-        for outcome_id, outcome_text in course_outcomes:
-            current_row = sheet.max_row + 1
-            sheet.merge_cells(start_row=current_row, start_column=1, end_row=current_row, end_column=2)
-            cell = sheet.cell(row=current_row, column=1, value=f"{outcome_text:>35}")
-            row = []
-            total = 0
 
-            for criteria in evaluation_weights.keys():
-                score = student[student_columns.index(criteria)]
-                weight_value = weighted_values.get(outcome_id, {}).get(criteria, 0)
-                weighted_score = score * weight_value
-                row.append(weighted_score)
-                total += weighted_score
+def table4_report_context(snapshot, formulas=False):
+    engine = snapshot.engine
+    return ([tuple(outcome) for outcome in snapshot.course_outcomes], engine.criteria, engine.max_scores.tolist(),
+            formulas)
 
-            max_score = sum(weighted_values.get(outcome_id, {}).values()) * 100
-            success_rate = (total / max_score * 100) if max_score > 0 else 0
 
-            row.extend([total, max_score, round(success_rate, 1)])
+def table4_report_data(snapshot, formulas=False):
+    return table4_report_context(snapshot, formulas), snapshot.engine.outcome_scores(snapshot.scores)
 
-            for col_index, value in enumerate(row, start=3):
-                sheet.cell(row=current_row, column=col_index, value=value)
 
-            cell = sheet.cell(row=current_row, column=1)
-            cell.comment = Comment(outcome_text, "Database")
+def table4_report_students(snapshot, chunk_size=None):
+    # Bir sonraki öğrenci parçası, önceki parçanın sayfaları yazılırken hesaplanır
+    def chunks():
+        for chunk in student_chunks(len(snapshot.student_ids), chunk_size):
+            scores = snapshot.engine.outcome_scores(snapshot.student_scores(chunk))
+            yield snapshot.student_ids[chunk], [column.tolist() for column in scores]
 
-    workbook.save("table4.xlsx")
+    for student_ids, columns in prefetch(chunks()):
+        yield from zip(student_ids, *columns)
 
 
-def save_table4_to_database():
-    conn = get_connection("RelationMatrix")
-    cursor = conn.cursor()
+def number_cell(sheet, value, number_format):
+    cell = WriteOnlyCell(sheet, value=value)
+    cell.number_format = number_format
+    return cell
 
-    cursor.execute("SELECT Criteria, Weight FROM EvaluationCriteria;")
-    evaluation_weights = {row[0]: row[1] for row in cursor.fetchall()}
 
-    cursor.execute("SELECT * FROM Students;")
-    student_columns = [column[0] for column in cursor.description]
-    student_data = cursor.fetchall()
+def write_table4_sheet(workbook, context, student_id, weighted_scores, totals, success_rates):
+    course_outcomes, criteria, max_scores, formulas = context
+    headers = [*criteria, "Total", "Max", "% Success"]
 
-    cursor.execute("SELECT id, data FROM CourseOutcomes;")
-    course_outcomes = cursor.fetchall()
-    cursor.execute("SELECT CourseOutcomeID, Criteria, RelationValue FROM CourseEvaluationRelations;")
-    course_evaluation_relations = cursor.fetchall()
-    conn.close()
+    sheet = add_report_sheet(workbook, f"Student {student_id}")
 
-    weighted_values = {}
-    for outcome_id, criteria, relation_value in course_evaluation_relations:
-        weight = evaluation_weights.get(criteria, 0)
-        if outcome_id not in weighted_values:
-            weighted_values[outcome_id] = {}
-        weighted_values[outcome_id][criteria] = relation_value * (weight / 100)
+    sheet.append(["Table 4", None, f"Student {student_id}", None])
+    sheet.append(["Program Outcomes", None, *headers])
+    merge_report_cells(sheet, "A1:B1")
+    merge_report_cells(sheet, "C1:D1")
+    merge_report_cells(sheet, "A2:B2")
 
-    conn = get_connection("RelationMatrix")
-    cursor = conn.cursor()
+    for o, (outcome_id, outcome_text) in enumerate(course_outcomes):
+        current_row = o + 3
+        cell = comment_cell(sheet, f"{outcome_text:>35}", outcome_text, "Database")
+        if formulas:
+            # Toplam ve başarı oranı Excel'de hesaplanır, ağırlıklı puanlar elle değiştirilse de güncel kalır
+            last_col = get_column_letter(len(criteria) + 2)
+            total_cell = f"{get_column_letter(len(criteria) + 3)}{current_row}"
+            max_cell = f"{get_column_letter(len(criteria) + 4)}{current_row}"
+            total = f"=SUM(C{current_row}:{last_col}{current_row})" if criteria else 0
+            success = number_cell(sheet, f"=IF({max_cell}>0,{total_cell}*100/{max_cell},0)", "0.0")
+            append_report_row(sheet, [cell, None, *weighted_scores[o], total, max_scores[o], success])
+        else:
+            append_report_row(sheet, [cell, None, *weighted_scores[o], totals[o], max_scores[o],
+                                      round(success_rates[o], 1)])
+        merge_report_cells(sheet, f"A{current_row}:B{current_row}")
+
+    finish_report_sheet(sheet)
+
+
+@instrumented
+def create_table4(snapshot=None, stream=False, formulas=False):
+    snapshot = snapshot or load_snapshot()
+    write_report_workbook(write_table4_sheet, table4_report_context(snapshot, formulas),
+                          table4_report_students(snapshot), report_path("table4.xlsx"), stream)
+
+
+def table4_rows(snapshot, student_indices=None, outcome_indices=None, chunk_size=None):
+    engine = snapshot.engine
+    chunk_size = chunk_size or SCORE_CHUNK_SIZE
+    if student_indices is None:
+        student_indices = range(len(snapshot.student_ids))
+    if outcome_indices is None:
+        outcome_indices = range(len(engine.course_ids))
+    max_scores = engine.max_scores.tolist()
+
+    # Öğrenci x ders çıktısı x kriter dizisi parça parça hesaplanır, bellek kullanımı parça boyutuyla sınırlı
+    for start in range(0, len(student_indices), chunk_size):
+        chunk = student_indices[start:start + chunk_size]
+        if isinstance(chunk, range) and chunk.step == 1:
+            scores = snapshot.student_scores(slice(chunk.start, chunk.stop))
+        else:
+            scores = snapshot.student_scores(list(chunk))
+        weighted_scores, totals, success_rates = engine.outcome_scores(scores)
+
+        weighted_scores = weighted_scores.tolist()
+        totals = totals.tolist()
+        success_rates = success_rates.tolist()
+
+        for s, student_index in enumerate(chunk):
+            student_id = snapshot.student_ids[student_index]
+            for o in outcome_indices:
+                yield (student_id, engine.course_ids[o], totals[s][o], *weighted_scores[s][o], max_scores[o],
+                       round(success_rates[s][o], 2))
+
+
+@instrumented
+def save_table4_to_database(snapshot=None, batch_size=None, incremental=False, set_based=False):
+    snapshot = snapshot or load_snapshot(students=not set_based)
+    engine = snapshot.engine
+
+    columns = ", ".join(f'"{criteria}"' for criteria in engine.criteria)
+    placeholders = ", ".join("?" for _ in engine.criteria)
+    insert_query = f"""
+            INSERT INTO Table4 (student_id, course_outcome_id, total_score, {columns}, max_score, success_rate)
+            VALUES (?, ?, ?, {placeholders}, ?, ?)
+        """
+
+    with pooled_connection("RelationMatrix") as conn:
+        cursor = conn.cursor()
+        backend = get_backend()
+
+        available = wide_student_criteria(cursor) if set_based and STUDENT_SCHEMA == "wide" else None
+        select_query, select_params = outcome_scores_query(engine.criteria, available)
+        insert_select = f"""
+            INSERT INTO Table4 (student_id, course_outcome_id, total_score, {columns}, max_score, success_rate)
+            {select_query}"""
+
+        changes = read_changes(cursor, "Table4", snapshot.change_id) if incremental else None
+        full_rebuild = (
+            changes is None
+            or not backend.table_exists(cursor, "Table4")
+            or "EvaluationCriteria" in changes
+            or "*" in changed_keys(changes, "CourseOutcome", "CourseEvaluationRelation", "Student")
+        )
+
+        if full_rebuild:
+            criteria_columns = ", ".join(f'"{criteria}" FLOAT' for criteria in engine.criteria)
+            reset_report_table(cursor, "Table4", ["id", "student_id", "course_outcome_id", "total_score",
+                                                  *engine.criteria, "max_score", "success_rate"], f"""
+                CREATE TABLE Table4 (
+                    id {backend.identity_column},
+                    student_id INT NOT NULL,
+                    course_outcome_id INT NOT NULL,
+                    total_score FLOAT NOT NULL,
+                    {criteria_columns},
+                    max_score FLOAT,
+                    success_rate FLOAT
+                );
+            """)
+
+            if set_based:
+                cursor.execute(insert_select, select_params)
+            else:
+                bulk_insert(cursor, insert_query, table4_rows(snapshot), batch_size)
+        else:
+            outcome_ids = {int(key) for key in changed_keys(changes, "CourseOutcome", "CourseEvaluationRelation")}
+            student_ids = {int(key) for key in changed_keys(changes, "Student")}
+
+            if student_ids:
+                # Aynı öğrenci numarası başka bir derste de olabilir
+                cursor.executemany(f"DELETE FROM Table4 WHERE student_id = ? "
+                                   f"AND course_outcome_id IN ({COURSE_OUTCOME_IDS})",
+                                   [(student_id, current_course()) for student_id in student_ids])
+            if outcome_ids:
+                cursor.executemany("DELETE FROM Table4 WHERE course_outcome_id = ?",
+                                   [(outcome_id,) for outcome_id in outcome_ids])
+
+            # Değişen ders çıktıları diğer öğrenciler için, değişen öğrenciler ise tüm çıktılar için yazılır
+            outcome_indices = engine.course_index.known(outcome_ids)
+            if set_based:
+                # Önce değişen çıktılar tüm öğrenciler için, sonra değişen öğrencilerin kalan çıktıları.
+                # Öğrenci numaraları doğrudan sorguya verilir; silinmiş öğrenciler SELECT'te zaten yoktur.
+                outcome_condition, outcome_params = in_list("w.course_outcome_id",
+                                                            [engine.course_ids[o] for o in outcome_indices])
+                if outcome_indices:
+                    cursor.execute(f"{insert_select}\n            WHERE {outcome_condition}",
+                                   select_params + outcome_params)
+                changed_ids = sorted(student_ids)
+                for start in range(0, len(changed_ids), IN_LIST_SIZE):
+                    condition, params = in_list("s.Student", changed_ids[start:start + IN_LIST_SIZE])
+                    if outcome_indices:
+                        condition = f"{condition} AND NOT {outcome_condition}"
+                        params += outcome_params
+                    cursor.execute(f"{insert_select}\n            WHERE {condition}", select_params + params)
+            else:
+                changed = np.zeros(len(snapshot.student_ids), dtype=bool)
+                changed[snapshot.student_index.known(student_ids)] = True
+                changed_students = np.flatnonzero(changed).tolist()
+                other_students = np.flatnonzero(~changed).tolist()
+                if outcome_indices and other_students:
+                    bulk_insert(cursor, insert_query, table4_rows(snapshot, other_students, outcome_indices),
+                                batch_size)
+                if changed_students:
+                    bulk_insert(cursor, insert_query, table4_rows(snapshot, changed_students), batch_size)
+
+        record_materialization(cursor, "Table4", snapshot.change_id)
+        conn.commit()
 
-    cursor.execute("SELECT * FROM INFORMATION_SCHEMA.TABLES WHERE TABLE_NAME = 'Table4';")
-    existing_table = cursor.fetchone()
 
-    if existing_table:
-        cursor.execute("DROP TABLE Table4;")
+def table5_report_context(snapshot, formulas=False):
+    engine = snapshot.engine
+    return ([outcome[1] for outcome in snapshot.course_outcomes],
+            [tuple(outcome) for outcome in snapshot.program_outcomes],
+            engine.dense_relations().tolist(), formulas)
 
-    criteria_columns = ", ".join(f'"{criteria}" FLOAT' for criteria in evaluation_weights.keys())
-    cursor.execute(f"""
-        CREATE TABLE Table4 (
-            id INT IDENTITY(1,1) PRIMARY KEY,
-            student_id INT NOT NULL,
-            course_outcome_id INT NOT NULL,
-            total_score FLOAT NOT NULL,
-            {criteria_columns},
-            max_score FLOAT,
-            success_rate FLOAT
-        );
-    """)
 
-    for student in student_data:
-        student_id = student[0]
+def table5_success_matrix(snapshot):
+    # Table4 satırları okunurken matrise yerleştirilir, satır listesi tutulmaz
+    return snapshot.engine.index_success_rates(snapshot.student_index, iter_success_rate(depth=PIPELINE_DEPTH))
 
-        for outcome_id, outcome_text in course_outcomes:
-            total_score = 0
-            criteria_values = []
 
-            for criteria in evaluation_weights.keys():
-                score = student[student_columns.index(criteria)]
-                weight_value = weighted_values.get(outcome_id, {}).get(criteria, 0)
-                weighted_score = score * weight_value
-                criteria_values.append(weighted_score)
-                total_score += weighted_score
+def table5_report_data(snapshot, formulas=False):
+    success_matrix = table5_success_matrix(snapshot)
+    values, ratios = snapshot.engine.attainment(success_matrix)
+    return table5_report_context(snapshot, formulas), (success_matrix, values, ratios)
 
-            max_score = sum(weighted_values.get(outcome_id, {}).values()) * 100
-            success_rate = (total_score / max_score * 100) if max_score > 0 else 0
 
-            columns = ", ".join(f'"{criteria}"' for criteria in evaluation_weights.keys())
-            placeholders = ", ".join("?" for _ in criteria_values)
+def table5_report_students(snapshot, success_matrix, chunk_size=None):
+    def chunks():
+        for chunk in student_chunks(len(snapshot.student_ids), chunk_size):
+            values, ratios = snapshot.engine.attainment(success_matrix[chunk])
+            yield snapshot.student_ids[chunk], success_matrix[chunk].tolist(), values.tolist(), ratios.tolist()
 
-            cursor.execute(f"""
-                INSERT INTO Table4 (student_id, course_outcome_id, total_score, {columns}, max_score, success_rate)
-                VALUES (?, ?, ?, {placeholders}, ?, ?)
-            """, (student_id, outcome_id, total_score, *criteria_values, max_score, round(success_rate, 2)))
+    for student_ids, success_rates, values, ratios in prefetch(chunks()):
+        yield from zip(student_ids, success_rates, values, ratios)
 
-    conn.commit()
-    conn.close()
 
+def write_table5_sheet(workbook, context, student_id, success_rates, values, ratios):
+    course_texts, program_outcomes, relations, formulas = context
 
-def create_table5():
-    workbook = Workbook()
-    students = fetch_student_data()
-    course_outcomes = fetch_table_data("CourseOutcomes")
-    program_outcomes = fetch_table_data("ProgramOutcomes")
-    relations = fetch_relations()
-    success_rates = fetch_success_rate()
-
-    for student in students:
-        student_id = student[0]
-
-        sheet = workbook.create_sheet(title=f"Student {student_id}")
-        row = 1
-
-        sheet.merge_cells("A1:B1")
-        sheet["A1"] = f"Student {student_id}"
-        row += 1
-
-        sheet.cell(row=row, column=1, value="Table 5")
-        for idx, outcome in enumerate(course_outcomes, start=2):
-            sheet.cell(row=row, column=idx, value=outcome[1])
-        row += 1
-
-        sheet.cell(row=row, column=1, value="ProgramOutcomes")
-        success_rate_for_student = [
-            sr[1] for sr in success_rates if sr[0] == student_id
-        ]
-        for idx, success_rate in enumerate(success_rate_for_student, start=2):
-            formatted_rate = round(success_rate, 1)
-            sheet.cell(row=row, column=idx, value=formatted_rate)
-        sheet.cell(row=row, column=idx + 1, value="Success Rate")
-        row += 1
-
-        for program_outcome in program_outcomes:
-            row_values = []
-            relation_values = []
-
-            for course_outcome, success_rate in zip(course_outcomes, success_rate_for_student):
-                relation_value = next(
-                    (relation[2] for relation in relations if
-                     relation[0] == program_outcome[0] and relation[1] == course_outcome[0]),
-                    0
-                )
-                relation_values.append(relation_value)
-
-            row_values = [
-                relation * success_rate
-                for relation, success_rate in zip(relation_values, success_rate_for_student)
-            ]
+    sheet = add_report_sheet(workbook, f"Student {student_id}")
+
+    sheet.append([f"Student {student_id}"])
+    merge_report_cells(sheet, "A1:B1")
+    sheet.append(["Table 5", *course_texts])
 
-            total_success = sum(row_values)
-            num_course_outcomes = len(course_outcomes)
-            avg_success = total_success / num_course_outcomes if num_course_outcomes else 0
-            avg_relation_value = sum(relation_values) / len(relation_values) if relation_values else 0
-            ratio = avg_success / avg_relation_value if avg_relation_value else 0
+    if not formulas:
+        sheet.append(["ProgramOutcomes", *(round(rate, 1) for rate in success_rates), "Success Rate"])
+        for p, (program_outcome_id, program_outcome_data) in enumerate(program_outcomes):
+            cell = comment_cell(sheet, program_outcome_id, f"{program_outcome_data}", "Generated")
+            append_report_row(sheet, [cell, *(round(value, 1) for value in values[p]), round(ratios[p], 1)])
+        finish_report_sheet(sheet)
+        return
 
-            program_outcome_id = program_outcome[0]
-            program_outcome_data = program_outcome[1]
-            cell = sheet.cell(row=row, column=1, value=program_outcome_id)
+    # Katkılar 3. satırdaki başarı oranlarına ve tablonun altındaki ilişki değerlerine bağlı formüller;
+    # oran ya da ilişki elle değişirse katkılar ve başarı oranı da değişir
+    columns = [get_column_letter(c + 2) for c in range(len(course_texts))]
+    relation_start = len(program_outcomes) + 6
+    append_report_row(sheet, ["ProgramOutcomes", *(number_cell(sheet, rate, "0.0") for rate in success_rates),
+                              "Success Rate"])
+    for p, (program_outcome_id, program_outcome_data) in enumerate(program_outcomes):
+        row = p + 4
+        relation_row = relation_start + p
+        cell = comment_cell(sheet, program_outcome_id, f"{program_outcome_data}", "Generated")
+        contributions = [number_cell(sheet, f"={column}{relation_row}*{column}$3", "0.0") for column in columns]
+        if columns:
+            relation_average = f"AVERAGE(B{relation_row}:{columns[-1]}{relation_row})"
+            ratio = f"=IF({relation_average}=0,0,AVERAGE(B{row}:{columns[-1]}{row})/{relation_average})"
+        else:
+            ratio = 0
+        append_report_row(sheet, [cell, *contributions, number_cell(sheet, ratio, "0.0")])
+
+    sheet.append([])
+    sheet.append(["Relations", *course_texts])
+    for p, (program_outcome_id, _) in enumerate(program_outcomes):
+        append_report_row(sheet, [program_outcome_id, *relations[p]])
+
+    finish_report_sheet(sheet)
+
+
+@instrumented
+def create_table5(snapshot=None, stream=False, formulas=False):
+    snapshot = snapshot or load_snapshot()
+    students = table5_report_students(snapshot, table5_success_matrix(snapshot))
+    write_report_workbook(write_table5_sheet, table5_report_context(snapshot, formulas), students,
+                          report_path("table5.xlsx"), stream)
+
+
+def _write_report_shard(write_sheet, context, student_ids, columns, filename, stream):
+    return write_report_workbook(write_sheet, context, zip(student_ids, *(column.tolist() for column in columns)),
+                                 filename, stream)
+
+
+def _write_student_files(write_sheet, context, student_ids, columns):
+    files = []
+    columns = [column.tolist() for column in columns]
+    for s, student_id in enumerate(student_ids):
+        workbook = Workbook()
+        write_sheet(workbook, context, student_id, *(column[s] for column in columns))
+        buffer = io.BytesIO()
+        workbook.save(buffer)
+        files.append((f"Student {student_id}.xlsx", buffer.getvalue()))
+    return files
+
+
+@instrumented
+def create_report_parallel(table, snapshot=None, workers=None, output="shards", stream=True, formulas=False):
+    # Öğrenci sayfaları birbirinden bağımsız; öğrencileri işlemlere bölüp her işlem kendi dosyasını yazar
+    if output not in ("shards", "zip"):
+        raise ValueError(f"Unknown parallel output mode: {output}")
+
+    snapshot = snapshot or load_snapshot()
+    if table == "table4":
+        write_sheet = write_table4_sheet
+        context, columns = table4_report_data(snapshot, formulas)
+    elif table == "table5":
+        write_sheet = write_table5_sheet
+        context, columns = table5_report_data(snapshot, formulas)
+    else:
+        raise ValueError(f"Parallel reports are only available for table4 and table5, not {table}.")
+
+    workers = workers or os.cpu_count() or 1
+    student_ids = snapshot.student_ids
+    chunks = [chunk for chunk in np.array_split(np.arange(len(student_ids)), workers) if len(chunk)]
+
+    with ProcessPoolExecutor(max_workers=workers) as executor:
+        if output == "shards":
+            futures = [
+                executor.submit(_write_report_shard, write_sheet, context, [student_ids[i] for i in chunk],
+                                [column[chunk] for column in columns], report_path(f"{table}_part{n:03d}.xlsx"),
+                                stream)
+                for n, chunk in enumerate(chunks, start=1)
+            ]
+            filenames = [future.result() for future in futures]
+            count_metric("bytes_saved", sum(os.path.getsize(filename) for filename in filenames))
+            return filenames
+
+        if output == "zip":
+            futures = [
+                executor.submit(_write_student_files, write_sheet, context, [student_ids[i] for i in chunk],
+                                [column[chunk] for column in columns])
+                for chunk in chunks
+            ]
+            filename = report_path(f"{table}.zip")
+            with zipfile.ZipFile(filename, "w", zipfile.ZIP_STORED) as archive:
+                for future in futures:
+                    for name, data in future.result():
+                        archive.writestr(name, data)
+            count_metric("bytes_saved", os.path.getsize(filename))
+            return [filename]
+
+
+# Dışa aktarılan tabloların sabit, uzun biçimli şeması; her dosyada önce "course" sütunu gelir
+EXPORT_TABLES = {
+    "relations": [("program_outcome_id", "int64"), ("course_outcome_id", "int64"), ("relation_value", "float64")],
+    "evaluation": [("course_outcome_id", "int64"), ("criteria", "string"), ("relation_value", "float64"),
+                   ("weight", "float64"), ("weighted_score", "float64")],
+    "student_scores": [("student_id", "int64"), ("criteria", "string"), ("score", "float64")],
+    "outcome_scores": [("student_id", "int64"), ("course_outcome_id", "int64"), ("total_score", "float64"),
+                       ("max_score", "float64"), ("success_rate", "float64")],
+    "criteria_scores": [("student_id", "int64"), ("course_outcome_id", "int64"), ("criteria", "string"),
+                        ("weighted_score", "float64")],
+    "attainment": [("student_id", "int64"), ("program_outcome_id", "int64"), ("attainment", "float64")],
+}
+EXPORT_FORMATS = {"parquet": ".parquet", "arrow": ".arrow"}
+
+
+def export_schema(table):
+    return pa.schema([("course", pa.dictionary(pa.int32(), pa.string())),
+                      *((name, getattr(pa, type_name)()) for name, type_name in EXPORT_TABLES[table])])
+
+
+def export_rows(snapshot, table, chunk_size=None):
+    # Her parça, şemadaki sırayla sütun dizileri; öğrenci tabloları SCORE_CHUNK_SIZE'lık parçalarla üretilir
+    engine = snapshot.engine
+    program_ids = np.array(engine.program_ids, dtype=np.int64)
+    course_ids = np.array(engine.course_ids, dtype=np.int64)
+    criteria = np.array(engine.criteria, dtype=object)
+
+    if table == "relations":
+        p, c, values = engine.relation_entries()
+        yield [program_ids[p], course_ids[c], values]
+    elif table == "evaluation":
+        c, k = np.nonzero(engine.evaluation)
+        yield [course_ids[c], criteria[k], engine.evaluation[c, k], engine.weights[k], engine.weighted[c, k]]
+    else:
+        # Sadece ilişkisi olan (ders çıktısı, kriter) çiftleri yazılır; diğerlerinin puanı her zaman 0
+        pairs = np.nonzero(engine.weighted)
+        for chunk in student_chunks(len(snapshot.student_ids), chunk_size):
+            student_ids = np.array(snapshot.student_ids[chunk], dtype=np.int64)
+            n = len(student_ids)
+            if table == "student_scores":
+                # Girilmemiş notlar yazılmaz; 0 alan notla karışmasın
+                scores = snapshot.raw_scores(chunk).ravel()
+                scored = ~np.isnan(scores)
+                yield [np.repeat(student_ids, len(criteria))[scored], np.tile(criteria, n)[scored], scores[scored]]
+                continue
 
-            comment_text = f"{program_outcome_data}"
-            cell.comment = Comment(comment_text, "Generated")
+            scores = snapshot.student_scores(chunk)
+
+            weighted_scores, totals, success_rates = engine.outcome_scores(scores)
+            # Table4'e yazılan değerlerle aynı yuvarlama; Table5 de bunları okur
+            success_rates = np.round(success_rates, 2)
+            if table == "outcome_scores":
+                yield [np.repeat(student_ids, len(course_ids)), np.tile(course_ids, n), totals.ravel(),
+                       np.tile(engine.max_scores, n), success_rates.ravel()]
+            elif table == "criteria_scores":
+                yield [np.repeat(student_ids, len(pairs[0])), np.tile(course_ids[pairs[0]], n),
+                       np.tile(criteria[pairs[1]], n), weighted_scores[:, pairs[0], pairs[1]].ravel()]
+            elif table == "attainment":
+                ratios = engine.attainment_ratios(success_rates)
+                yield [np.repeat(student_ids, len(program_ids)), np.tile(program_ids, n), ratios.ravel()]
+
+
+def export_writer(path, schema, format):
+    if format == "parquet":
+        return pq.ParquetWriter(path, schema, compression="zstd")
+    # Arrow IPC sıkıştırılmadan yazılır ki read_export dosyayı kopyalamadan belleğe eşleyebilsin
+    return pa.ipc.new_file(path, schema)
+
+
+@instrumented
+def export_tables(snapshot=None, directory="export", format="parquet", tables=None):
+    # Tablo 1-5 ve notların hesaplanmış değerlerini analiz için sütunlu dosyalara yaz
+    if pa is None:
+        raise RuntimeError("pyarrow is required to export Parquet or Arrow files.")
+    if format not in EXPORT_FORMATS:
+        raise ValueError(f"Unknown export format: {format}")
+    unknown = [table for table in tables or [] if table not in EXPORT_TABLES]
+    if unknown:
+        raise ValueError(f"Unknown export tables: {', '.join(unknown)}")
+
+    snapshot = snapshot or load_snapshot()
+    directory = report_path(directory)
+    os.makedirs(directory, exist_ok=True)
+    course = pa.array([current_course()], pa.string())
+
+    filenames = []
+    for table in tables or EXPORT_TABLES:
+        schema = export_schema(table)
+        filename = os.path.join(directory, table + EXPORT_FORMATS[format])
+        writer = export_writer(filename, schema, format)
+        try:
+            for columns in export_rows(snapshot, table):
+                courses = pa.DictionaryArray.from_arrays(pa.array(np.zeros(len(columns[0]), dtype=np.int32)), course)
+                writer.write_table(pa.Table.from_arrays([courses, *columns], schema=schema))
+        finally:
+            writer.close()
+        count_metric("bytes_saved", os.path.getsize(filename))
+        filenames.append(filename)
+    return filenames
 
-            for idx, value in enumerate(row_values, start=2):
-                sheet.cell(row=row, column=idx, value=round(value, 1))
-            sheet.cell(row=row, column=idx + 1, value=round(ratio, 1))
-            row += 1
 
-    del workbook['Sheet']
-    workbook.save("table5.xlsx")
+def read_export(path):
+    # Arrow dosyaları belleğe eşlenir, sütunlar dosyadan kopyalanmadan okunur; Parquet açılırken çözülür
+    if pa is None:
+        raise RuntimeError("pyarrow is required to read Parquet or Arrow files.")
+    if path.endswith(EXPORT_FORMATS["arrow"]):
+        return pa.ipc.open_file(pa.memory_map(path)).read_all()
+    return pq.read_table(path, memory_map=True)
 
 
 def get_input_and_insert_relations():
@@ -704,7 +2482,7 @@ def get_input_and_insert_relations():
 
         try:
             relation_value = float(relation_value)
-            if 0 <= relation_value <= 1:
+            if is_valid_relation_value(relation_value):
                 insert_relation_value(program_outcome_id, course_outcome_id, relation_value)
             else:
                 print("Please enter a relation value between 0 and 1.")
@@ -732,7 +2510,7 @@ def get_input_and_insert_evaluation_relations():
 
         try:
             relation_value = int(relation_value)
-            if (relation_value == 0 or relation_value == 1):
+            if is_valid_evaluation_relation_value(relation_value):
                 insert_evaluation_relation_value(course_outcome_id, evaluation_criteria, relation_value)
             else:
                 print("Please enter a relation value of 0 or 1 .")
@@ -741,34 +2519,31 @@ def get_input_and_insert_evaluation_relations():
 
 
 def insert_relation_value(program_outcome_id, course_outcome_id, relation_value):
-    conn = get_connection("RelationMatrix")
-    conn.autocommit = True
-    cursor = conn.cursor()
-
-    cursor.execute('''
-        INSERT INTO ProgramCourseRelations (ProgramOutcomeID, CourseOutcomeID, RelationValue)
-        VALUES (?, ?, ?);
-    ''', program_outcome_id, course_outcome_id, relation_value)
+    with pooled_connection("RelationMatrix") as conn:
+        cursor = conn.cursor()
 
-    print(
-        f"Relation between ProgramOutcome {program_outcome_id} and CourseOutcome {course_outcome_id} has been inserted.")
+        cursor.execute('''
+            INSERT INTO ProgramCourseRelations (ProgramOutcomeID, CourseOutcomeID, RelationValue)
+            VALUES (?, ?, ?);
+        ''', (program_outcome_id, course_outcome_id, relation_value))
+        conn.commit()
 
-    conn.close()
+        print(
+            f"Relation between ProgramOutcome {program_outcome_id} and CourseOutcome {course_outcome_id} has been inserted.")
 
 
 def insert_evaluation_relation_value(course_outcome_id, criteria, relation_value):
-    conn = get_connection("RelationMatrix")
-    conn.autocommit = True
-    cursor = conn.cursor()
+    with pooled_connection("RelationMatrix") as conn:
+        cursor = conn.cursor()
 
-    cursor.execute('''
-        INSERT INTO CourseEvaluationRelations (CourseOutcomeID, Criteria, RelationValue)
-        VALUES (?, ?, ?);
-    ''', course_outcome_id, criteria, relation_value)
-
-    print(f"Relation between CourseOutcome {course_outcome_id} and EvaluationCriteria {criteria} has been inserted.")
+        cursor.execute('''
+            INSERT INTO CourseEvaluationRelations (CourseOutcomeID, Criteria, RelationValue)
+            VALUES (?, ?, ?);
+        ''', (course_outcome_id, criteria, relation_value))
+        log_change(cursor, "CourseEvaluationRelation", course_outcome_id)
+        conn.commit()
 
-    conn.close()
+        print(f"Relation between CourseOutcome {course_outcome_id} and EvaluationCriteria {criteria} has been inserted.")
 
 
 def get_input_and_insert_table(table_name):
@@ -820,18 +2595,18 @@ def get_evaluation_criteria_and_insert():
         print(f"Total weight is {total_weight}, which is less than 100. Please try again.")
         return
 
-    conn = get_connection("RelationMatrix")
-    conn.autocommit = True
-    cursor = conn.cursor()
+    with pooled_connection("RelationMatrix") as conn:
+        cursor = conn.cursor()
 
-    for criterion, weight in criteria_data:
-        cursor.execute('''
-            INSERT INTO EvaluationCriteria (Criteria, Weight)
-            VALUES (?, ?);
-        ''', criterion, weight)
+        for criterion, weight in criteria_data:
+            cursor.execute('''
+                INSERT INTO EvaluationCriteria (Criteria, Weight)
+                VALUES (?, ?);
+            ''', (criterion, weight))
+            log_change(cursor, "EvaluationCriteria", criterion)
+        conn.commit()
 
-    print("Evaluation criteria have been successfully inserted into the database.")
-    conn.close()
+        print("Evaluation criteria have been successfully inserted into the database.")
 
 
 is_table_created = False
@@ -843,85 +2618,290 @@ def create_students_table():
     if is_table_created:
         return
 
-    conn = get_connection("RelationMatrix")
-    cursor = conn.cursor()
+    with pooled_connection("RelationMatrix") as conn:
+        cursor = conn.cursor()
+
+        cursor.execute("SELECT Criteria FROM EvaluationCriteria;")
+        criteria = [row[0] for row in cursor.fetchall()]
+
+        if not criteria:
+            print("No evaluation criteria found. Please add criteria first.")
+            return
+
+        if STUDENT_SCHEMA == "long":
+            # Uzun düzende kriter değişikliği tablo yapısını değiştirmez, mevcut notlar korunur
+            if create_student_scores_table(cursor):
+                conn.commit()
+            is_table_created = True
+            return
+
+        backend = get_backend()
+        if backend.table_exists(cursor, "Students"):
+            print("Students table already exists.")
+            if backend.column_names(cursor, "Students") == ["Student", *criteria, "Course"]:
+                # Tablo diğer derslerin öğrencilerini de tutar; sadece geçerli dersinkileri temizle
+                cursor.execute("DELETE FROM Students WHERE Course = ?;", (current_course(),))
+                log_change(cursor, "Student", "*")
+                conn.commit()
+                is_table_created = True
+                return
+            cursor.execute("DROP TABLE Students;")
+
+        cursor.execute(f"CREATE TABLE Students ({', '.join(student_table_columns(criteria))});")
+        cursor.execute(CHANGE_QUERY, ("Student", "*", "*"))
+        conn.commit()
+    is_table_created = True
 
-    cursor.execute("SELECT Criteria FROM EvaluationCriteria;")
-    criteria = [row[0] for row in cursor.fetchall()]
 
-    if not criteria:
-        print("No evaluation criteria found. Please add criteria first.")
-        conn.close()
-        return
+def student_table_columns(criteria):
+    # Course sütunu en sonda; kriter sütunları Student'tan sonra Students tablosundaki sırayla okunur
+    columns = ["Student INT NOT NULL"]
+    for criterion in criteria:
+        columns.append(f'[{criterion}] FLOAT')
+    columns.append("Course VARCHAR(40) NOT NULL DEFAULT 'default'")
+    columns.append("PRIMARY KEY (Course, Student)")
+    return columns
 
-    cursor.execute("SELECT TABLE_NAME FROM INFORMATION_SCHEMA.TABLES WHERE TABLE_NAME = 'Students';")
-    existing_table = cursor.fetchone()
 
-    if existing_table:
-        print("Students table already exists.")
-        cursor.execute("DROP TABLE Students;")
+def add_student():
+    with pooled_connection("RelationMatrix") as conn:
+        cursor = conn.cursor()
 
-    columns = ["Student INT PRIMARY KEY"]
-    for criterion in criteria:
-        columns.append(f'[{criterion}] FLOAT')
+        criteria_query = "SELECT Criteria FROM EvaluationCriteria;"
+        cursor.execute(criteria_query)
+        criteria = [row[0] for row in cursor.fetchall()]
 
-    create_table_query = f"CREATE TABLE Students ({', '.join(columns)});"
-    cursor.execute(create_table_query)
-    conn.commit()
+        if not criteria:
+            print("No evaluation criteria found. Please add criteria first.")
+            return
 
-    conn.close()
-    is_table_created = True
+        while True:
+            student_number = input("Enter Student Number (or 'q' to quit): ").strip()
+            if student_number.lower() == 'q':
+                print("Exiting student data entry.")
+                break
 
+            if not student_number.isdigit():
+                print("Invalid Student Number. Please enter a valid number.")
+                continue
 
-def add_student():
-    conn = get_connection("RelationMatrix")
-    cursor = conn.cursor()
+            student_data = [int(student_number)]
+            for criterion in criteria:
+                while True:
+                    score = input(f"Enter score for {criterion} (0-100): ").strip()
+                    if not score.isdigit() and score.lower() != 'q':
+                        print("Invalid input. Please enter a valid numeric score.")
+                        continue
+                    if score.lower() == 'q':
+                        print("Exiting student data entry.")
+                        return
+                    score = float(score)
+                    if is_valid_score(score):
+                        student_data.append(score)
+                        break
+                    else:
+                        print("Please enter a valid score between 0 and 100.")
+
+            if STUDENT_SCHEMA == "long":
+                cursor.execute("DELETE FROM StudentScores WHERE Course = ? AND Student = ?",
+                               (current_course(), student_data[0]))
+                cursor.executemany("INSERT INTO StudentScores (Student, Criteria, Score, Course) VALUES (?, ?, ?, ?)",
+                                   list(student_score_rows([student_data], criteria)))
+            else:
+                columns = ["Student"] + [f"[{criterion}]" for criterion in criteria] + ["Course"]
+                placeholders = ", ".join(["?"] * len(columns))
+                insert_query = f"INSERT INTO Students ({', '.join(columns)}) VALUES ({placeholders});"
 
-    criteria_query = "SELECT Criteria FROM EvaluationCriteria;"
-    cursor.execute(criteria_query)
-    criteria = [row[0] for row in cursor.fetchall()]
+                cursor.execute(insert_query, [*student_data, current_course()])
+            log_change(cursor, "Student", student_data[0])
+            conn.commit()
+            print("Student data has been successfully added.")
 
-    if not criteria:
-        print("No evaluation criteria found. Please add criteria first.")
-        conn.close()
-        return
 
-    while True:
-        student_number = input("Enter Student Number (or 'q' to quit): ").strip()
-        if student_number.lower() == 'q':
-            print("Exiting student data entry.")
-            break
+def is_valid_relation_value(value):
+    return 0 <= value <= 1
 
-        if not student_number.isdigit():
-            print("Invalid Student Number. Please enter a valid number.")
-            continue
 
-        student_data = [int(student_number)]
-        for criterion in criteria:
-            while True:
-                score = input(f"Enter score for {criterion} (0-100): ").strip()
-                if not score.isdigit() and score.lower() != 'q':
-                    print("Invalid input. Please enter a valid numeric score.")
-                    continue
-                if score.lower() == 'q':
-                    print("Exiting student data entry.")
-                    conn.close()
-                    return
-                score = float(score)
-                if 0 <= score <= 100:
-                    student_data.append(score)
-                    break
-                else:
-                    print("Please enter a valid score between 0 and 100.")
+def is_valid_evaluation_relation_value(value):
+    return value in (0, 1)
+
+
+def is_valid_score(score):
+    return 0 <= score <= 100
+
+
+def read_import_rows(path):
+    if path.lower().endswith((".xlsx", ".xlsm")):
+        workbook = load_workbook(path, read_only=True, data_only=True)
+        rows = workbook.active.iter_rows(values_only=True)
+        headers = [str(header).strip() if header is not None else "" for header in next(rows, ())]
+        for row in rows:
+            if all(value is None for value in row):
+                continue
+            yield dict(zip(headers, row))
+        workbook.close()
+    else:
+        with open(path, newline="", encoding="utf-8-sig") as file:
+            for row in csv.DictReader(file):
+                yield {header.strip(): value for header, value in row.items() if header is not None}
+
+
+def parse_outcome_row(row):
+    data = str(row["data"] or "").strip()
+    if not data:
+        raise ValueError("data must not be empty")
+    return (data,)
+
+
+def parse_relation_row(row):
+    relation_value = float(row["RelationValue"])
+    if not is_valid_relation_value(relation_value):
+        raise ValueError("RelationValue must be between 0 and 1")
+    return int(row["ProgramOutcomeID"]), int(row["CourseOutcomeID"]), relation_value
 
-        columns = ["Student"] + criteria
-        placeholders = ", ".join(["?"] * len(columns))
-        insert_query = f"INSERT INTO Students ({', '.join(columns)}) VALUES ({placeholders});"
 
-        cursor.execute(insert_query, student_data)
+def parse_evaluation_relation_row(row):
+    relation_value = int(row["RelationValue"])
+    if not is_valid_evaluation_relation_value(relation_value):
+        raise ValueError("RelationValue must be 0 or 1")
+    return int(row["CourseOutcomeID"]), str(row["Criteria"]).strip(), relation_value
+
+
+def parse_criteria_row(row):
+    weight = int(row["Weight"])
+    if weight < 0:
+        raise ValueError("Weight must be a positive integer")
+    return str(row["Criteria"]).strip(), weight
+
+
+def parse_student_row(row, criteria):
+    student_data = [int(row["Student"])]
+    for criterion in criteria:
+        score = float(row[criterion])
+        if not is_valid_score(score):
+            raise ValueError(f"score for {criterion} must be between 0 and 100")
+        student_data.append(score)
+    return tuple(student_data)
+
+
+@instrumented
+def import_file(kind, path, batch_size=None):
+    with pooled_connection("RelationMatrix") as conn:
+        cursor = conn.cursor()
+        cursor.execute("SELECT Criteria FROM EvaluationCriteria;")
+        criteria = [row[0] for row in cursor.fetchall()]
+
+    if kind in ("program_outcomes", "course_outcomes"):
+        parse = parse_outcome_row
+    elif kind == "relations":
+        parse = parse_relation_row
+    elif kind == "criteria":
+        parse = parse_criteria_row
+    elif kind == "evaluation_relations":
+        parse = parse_evaluation_relation_row
+    elif kind == "students":
+        if not criteria:
+            print("No evaluation criteria found. Please add criteria first.")
+            return 0
+        parse = partial(parse_student_row, criteria=criteria)
+    else:
+        raise ValueError(f"Unknown import type: {kind}")
+
+    # Önce tüm dosyayı doğrula; hatalı satır varsa hiçbir şey yazma
+    rows = []
+    errors = []
+    for line, row in enumerate(read_import_rows(path), start=2):
+        try:
+            rows.append(parse(row))
+        except KeyError as error:
+            errors.append(f"row {line}: missing column {error}")
+        except (TypeError, ValueError) as error:
+            errors.append(f"row {line}: {error}")
+
+    if kind == "criteria" and sum(weight for _, weight in rows) != 100:
+        errors.append(f"total weight is {sum(weight for _, weight in rows)}, it must be 100")
+    if kind == "evaluation_relations":
+        errors.extend(f"unknown criteria {name}" for name in sorted({row[1] for row in rows} - set(criteria)))
+
+    if errors:
+        for error in errors:
+            print(error)
+        print(f"{path} was not imported.")
+        return 0
+
+    with pooled_connection("RelationMatrix") as conn:
+        cursor = conn.cursor()
+        course = current_course()
+
+        if kind == "program_outcomes":
+            program = course_program(cursor)
+            bulk_insert(cursor, "INSERT INTO ProgramOutcomes (data, Program) VALUES (?, ?)",
+                        [(*row, program) for row in rows], batch_size)
+        elif kind == "course_outcomes":
+            bulk_insert(cursor, "INSERT INTO CourseOutcomes (data, Course) VALUES (?, ?)",
+                        [(*row, course) for row in rows], batch_size)
+            log_change(cursor, "CourseOutcome", "*")
+        elif kind == "relations":
+            bulk_insert(cursor, "INSERT INTO ProgramCourseRelations (ProgramOutcomeID, CourseOutcomeID, RelationValue) "
+                                "VALUES (?, ?, ?)", rows, batch_size)
+        elif kind == "criteria":
+            cursor.execute("DELETE FROM CourseEvaluationRelations")
+            cursor.execute("DELETE FROM EvaluationCriteria")
+            bulk_insert(cursor, "INSERT INTO EvaluationCriteria (Criteria, Weight) VALUES (?, ?)", rows, batch_size)
+            log_change(cursor, "EvaluationCriteria", "*")
+        elif kind == "evaluation_relations":
+            bulk_insert(cursor, "INSERT INTO CourseEvaluationRelations (CourseOutcomeID, Criteria, RelationValue) "
+                                "VALUES (?, ?, ?)", rows, batch_size)
+            bulk_insert(cursor, CHANGE_QUERY, [("CourseEvaluationRelation", str(course_outcome_id), course)
+                                               for course_outcome_id in {row[0] for row in rows}], batch_size)
+        elif kind == "students" and STUDENT_SCHEMA == "long":
+            create_student_scores_table(cursor)
+            if rows:
+                cursor.executemany("DELETE FROM StudentScores WHERE Course = ? AND Student = ?",
+                                   [(course, row[0]) for row in rows])
+            bulk_insert(cursor, "INSERT INTO StudentScores (Student, Criteria, Score, Course) VALUES (?, ?, ?, ?)",
+                        student_score_rows(rows, criteria), batch_size)
+            bulk_insert(cursor, CHANGE_QUERY, [("Student", str(row[0]), course) for row in rows], batch_size)
+        elif kind == "students":
+            if not get_backend().table_exists(cursor, "Students"):
+                cursor.execute(f"CREATE TABLE Students ({', '.join(student_table_columns(criteria))});")
+            else:
+                # Kriterler tablo oluşturulduktan sonra değiştiyse yeni kriterlerin sütunlarını ekle
+                existing = wide_student_criteria(cursor)
+                for criterion in criteria:
+                    if criterion not in existing:
+                        cursor.execute(f"ALTER TABLE Students ADD [{criterion}] FLOAT;")
+
+            # Aynı öğrenci tekrar yüklenirse (ör. geç gelen sınav notu) eski satırın yerine geçer
+            if rows:
+                cursor.executemany("DELETE FROM Students WHERE Course = ? AND Student = ?",
+                                   [(course, row[0]) for row in rows])
+            columns = ", ".join(f'[{criterion}]' for criterion in criteria)
+            placeholders = ", ".join("?" for _ in criteria)
+            bulk_insert(cursor, f"INSERT INTO Students (Student, {columns}, Course) VALUES (?, {placeholders}, ?)",
+                        [(*row, course) for row in rows], batch_size)
+            bulk_insert(cursor, CHANGE_QUERY, [("Student", str(row[0]), course) for row in rows], batch_size)
+
         conn.commit()
-        print("Student data has been successfully added.")
-    conn.close()
+
+    print(f"{len(rows)} rows imported from {path}.")
+    return len(rows)
+
+
+def get_input_and_import_file():
+    kinds = ["program_outcomes", "course_outcomes", "relations", "criteria", "evaluation_relations", "students"]
+    print(f"Import types: {', '.join(kinds)}")
+    kind = input("Enter import type: ").strip()
+    if kind not in kinds:
+        print("Invalid import type.")
+        return
+
+    path = input("Enter CSV or XLSX file path: ").strip()
+    if not os.path.exists(path):
+        print(f"{path} does not exist.")
+        return
+
+    import_file(kind, path)
 
 
 def menu():
@@ -936,9 +2916,10 @@ def menu():
         print("5. Add CourseOutcome-Criteria Relations")
         print("\nFor TABLE 4:")
         print("6. Add Student")
-        print("\n7. Exit")
+        print("\n7. Import from CSV/XLSX file")
+        print("8. Exit")
 
-        choice = input("Enter your choice (1-7): ").strip()
+        choice = input("Enter your choice (1-8): ").strip()
 
         if choice == '1':
             get_input_and_insert_table('ProgramOutcomes')
@@ -947,12 +2928,12 @@ def menu():
         elif choice == '3':
             get_input_and_insert_relations()
         elif choice == '4':
-            conn = get_connection("RelationMatrix")
-            conn.autocommit = True
-            cursor = conn.cursor()
-            cursor.execute("DELETE FROM CourseEvaluationRelations")
-            cursor.execute("DELETE FROM EvaluationCriteria")
-            conn.close()
+            with pooled_connection("RelationMatrix") as conn:
+                cursor = conn.cursor()
+                cursor.execute("DELETE FROM CourseEvaluationRelations")
+                cursor.execute("DELETE FROM EvaluationCriteria")
+                log_change(cursor, "EvaluationCriteria", "*")
+                conn.commit()
             get_evaluation_criteria_and_insert()
         elif choice == '5':
             get_input_and_insert_evaluation_relations()
@@ -960,20 +2941,431 @@ def menu():
             create_students_table()
             add_student()
         elif choice == '7':
+            get_input_and_import_file()
+        elif choice == '8':
             print("Exiting the program.")
             break
         else:
-            print("Invalid choice. Please enter a number between 1 and 7.")
-
-
-check_database()
-check_tables()
-menu()
-create_table1()
-create_table2()
-create_table3()
-save_table3_to_database()
-create_notes()
-create_table4()
-save_table4_to_database()
-create_table5()
+            print("Invalid choice. Please enter a number between 1 and 8.")
+
+
+class Stage:
+    def __init__(self, function, inputs=(), outputs=(), database=False):
+        self.function = function
+        self.inputs = list(inputs)
+        self.outputs = list(outputs)
+        self.database = database
+
+
+def report_stages(incremental=True, stream=False, batch_size=None, set_based=False, formulas=False,
+                  export_format="parquet"):
+    # Her aşamanın girdileri ve çıktıları; Table5, save_table4_to_database'in yazdığı Table4'ü okur
+    return {
+        "table1": Stage(partial(create_table1, formulas=formulas), ["snapshot"], ["table1.xlsx"]),
+        "table2": Stage(partial(create_table2, formulas=formulas), ["snapshot"], ["table2.xlsx"]),
+        "table3": Stage(create_table3, ["snapshot"], ["table3.xlsx"]),
+        "notes": Stage(create_notes, ["snapshot"], ["notlar.xlsx"]),
+        "table4": Stage(partial(create_table4, stream=stream, formulas=formulas), ["snapshot"], ["table4.xlsx"]),
+        "materialize3": Stage(partial(save_table3_to_database, batch_size=batch_size, incremental=incremental,
+                                      set_based=set_based), ["snapshot"], ["Table3"], database=True),
+        "materialize4": Stage(partial(save_table4_to_database, batch_size=batch_size, incremental=incremental,
+                                      set_based=set_based), ["snapshot"], ["Table4"], database=True),
+        "table5": Stage(partial(create_table5, stream=stream, formulas=formulas), ["snapshot", "Table4"],
+                        ["table5.xlsx"], database=True),
+        "export": Stage(partial(export_tables, format=export_format), ["snapshot"], ["export"]),
+    }
+
+
+_database_lock = threading.Lock()
+
+
+def run_database_stage(function, snapshot):
+    # Toplu çalıştırmada farklı derslerin veritabanı aşamaları da aynı anda tek yazıcıya düşmeli
+    with _database_lock:
+        return function(snapshot)
+
+
+def run_stages(stages, names=None, snapshot=None, workers=4):
+    selected = {name: stages[name] for name in (names or stages)}
+    snapshot = snapshot or load_snapshot()
+
+    # Profil süreç genelinde alınır; aşamalar aynı anda çalışırsa ölçümleri birbirine karışır
+    if PROFILE_MODE is not None:
+        workers = 1
+
+    # Seçili hiçbir aşamanın üretmediği girdiler önceki çalıştırmalardan hazır kabul edilir
+    produced = {output for stage in selected.values() for output in stage.outputs}
+    ready = {"snapshot"} | {resource for stage in selected.values() for resource in stage.inputs
+                            if resource not in produced}
+
+    # SQLite aynı anda tek yazıcıya izin verir, veritabanı kullanan aşamaları sıraya koy
+    serialize_database = not get_backend().concurrent_writes
+    database_busy = False
+
+    pending = dict(selected)
+    running = {}
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        while pending or running:
+            for name, stage in list(pending.items()):
+                if len(running) >= workers:
+                    break
+                if not all(resource in ready for resource in stage.inputs):
+                    continue
+                if stage.database and serialize_database:
+                    if database_busy:
+                        continue
+                    database_busy = True
+                del pending[name]
+                function = stage.function
+                if stage.database and serialize_database:
+                    function = partial(run_database_stage, stage.function)
+                # Aşama, geçerli dersi ve çıktı dizinini çağıranın bağlamından alır
+                future = executor.submit(contextvars.copy_context().run, function, snapshot)
+                running[future] = (name, time.perf_counter())
+
+            if not running:
+                raise RuntimeError(f"Stages {', '.join(sorted(pending))} wait for inputs that are never produced.")
+
+            done, _ = wait(running, return_when=FIRST_COMPLETED)
+            for future in done:
+                name, started = running.pop(future)
+                future.result()
+                ready.update(selected[name].outputs)
+                if selected[name].database and serialize_database:
+                    database_busy = False
+                print(f"{name} finished in {time.perf_counter() - started:.2f} s")
+
+
+def run_course(course, stage_names=None, stage_workers=1, output_root="reports", evaluation_criteria=None,
+               snapshot=None, **stage_options):
+    with use_course(course, os.path.join(output_root, course)):
+        snapshot = snapshot or load_snapshot(evaluation_criteria)
+        run_stages(report_stages(**stage_options), stage_names, snapshot, stage_workers)
+    return course
+
+
+def course_snapshots(courses, evaluation_criteria):
+    for course in courses:
+        with use_course(course):
+            snapshot = load_snapshot(evaluation_criteria)
+        yield course, snapshot
+
+
+BATCH_SETTINGS = ("POOL_SIZE", "POOL_TIMEOUT", "HEALTH_CHECK_INTERVAL", "FETCH_SIZE", "PIPELINE_DEPTH", "METRICS_PATH",
+                  "PROFILE_MODE", "PROFILE_DIR", "CACHE_DIR", "CACHE_MAX_AGE", "CACHE_MAX_BYTES", "SCORE_STORE_DIR",
+                  "SCORE_CHUNK_SIZE", "STUDENT_SCHEMA", "SPARSE_RELATIONS", "SPARSE_MAX_DENSITY", "SPARSE_MIN_CELLS")
+
+
+def _init_batch_worker(backend, settings):
+    global _backend
+
+    # fork ile kopyalanan havuz bağlantıları üst işlemindir; kapatmadan bırak, işçi kendi havuzunu açar
+    with _pools_lock:
+        _pools.clear()
+    _backend = backend
+    globals().update(settings)
+
+
+def run_batch(courses=None, stage_names=None, workers=None, stage_workers=1, output_root="reports",
+              executor="thread", prefetch_depth=None, **stage_options):
+    # Dersler birbirinden bağımsız; havuz ve ortak kriterler bir kez hazırlanır, dersler işçilere dağıtılır.
+    # thread modunda sonraki derslerin anlık görüntüleri, önceki dersler hesaplanıp yazılırken okunur.
+    courses = courses or list_courses()
+    if not courses:
+        print("No courses found.")
+        return []
+
+    with pooled_connection("RelationMatrix") as conn:
+        cursor = conn.cursor()
+        cursor.execute("SELECT Criteria, Weight FROM EvaluationCriteria;")
+        evaluation_criteria = [tuple(row) for row in cursor.fetchall()]
+
+    workers = workers or min(len(courses), os.cpu_count() or 1)
+    if PROFILE_MODE is not None and executor == "thread":
+        # Profil süreç genelinde alınır: dersler sırayla çalışır, anlık görüntüler de önceden okunmaz
+        workers = 1
+        prefetch_depth = 0
+
+    # Havuz aynı anda çalışan tüm aşamalara ve anlık görüntü okuyucusuna yetmeli, yoksa işçiler POOL_TIMEOUT
+    # sonunda bağlantı alamadan düşer. process modunda her işlemin kendi havuzu vardır.
+    connections = (stage_workers if executor == "process" else workers * stage_workers) + 1
+    if connections > POOL_SIZE:
+        configure_pool(size=connections)
+    if executor == "process":
+        settings = {name: globals()[name] for name in BATCH_SETTINGS}
+        pool = ProcessPoolExecutor(max_workers=workers, initializer=_init_batch_worker,
+                                   initargs=(get_backend(), settings))
+    elif executor == "thread":
+        pool = ThreadPoolExecutor(max_workers=workers)
+    else:
+        raise ValueError(f"Unknown batch executor: {executor}")
+
+    if executor == "thread":
+        snapshots = prefetch(course_snapshots(courses, evaluation_criteria), prefetch_depth)
+    else:
+        # Anlık görüntüler işlemler arasında taşınmaz, her işçi kendi dersini okur
+        snapshots = ((course, None) for course in courses)
+
+    # Okuyucu en fazla prefetch_depth ders önde gider; çalışan ders sayısı da işçi sayısıyla sınırlı
+    slots = threading.BoundedSemaphore(workers)
+    futures = {}
+    finished = []
+    with pool:
+        for course, snapshot in snapshots:
+            slots.acquire()
+            future = pool.submit(run_course, course, stage_names, stage_workers, output_root, evaluation_criteria,
+                                 snapshot, **stage_options)
+            future.add_done_callback(lambda _: slots.release())
+            futures[future] = course
+        for future in as_completed(futures):
+            finished.append(future.result())
+            print(f"Course {futures[future]} finished.")
+    return finished
+
+
+def parse_table_list(value):
+    return [table.strip().lower() for table in value.split(",") if table.strip()]
+
+
+def parse_course_list(value):
+    return [course.strip() for course in value.split(",") if course.strip()]
+
+
+def run_interactive(args):
+    check_database()
+    check_tables()
+    menu()
+    run_stages(report_stages())
+
+
+def run_init_schema(args):
+    check_database()
+    check_tables()
+
+
+def run_import(args):
+    if import_file(args.kind, args.path, args.batch_size) == 0:
+        raise SystemExit(1)
+
+
+def run_report(args):
+    snapshot = load_snapshot()
+    for table in args.tables:
+        if table in ("4", "5") and args.parallel:
+            create_report_parallel(f"table{table}", snapshot, args.parallel, args.output, stream=True,
+                                   formulas=args.formulas)
+        elif table == "1":
+            create_table1(snapshot, formulas=args.formulas)
+        elif table == "2":
+            create_table2(snapshot, formulas=args.formulas)
+        elif table == "3":
+            create_table3(snapshot)
+        elif table == "notes":
+            create_notes(snapshot)
+        elif table == "4":
+            create_table4(snapshot, stream=args.stream, formulas=args.formulas)
+        elif table == "5":
+            create_table5(snapshot, stream=args.stream, formulas=args.formulas)
+        else:
+            raise SystemExit(f"Unknown report table: {table}")
+
+
+def run_export(args):
+    unknown = [name for name in args.tables or [] if name not in EXPORT_TABLES]
+    if unknown:
+        raise SystemExit(f"Unknown export tables: {', '.join(unknown)}. Choose from {', '.join(EXPORT_TABLES)}.")
+    for filename in export_tables(directory=args.output_dir, format=args.format, tables=args.tables):
+        print(f"{filename} written.")
+
+
+def run_migrate_scores(args):
+    migrate_students_to_long(drop_wide=args.drop_wide, force=args.force)
+
+
+def run_materialize(args):
+    snapshot = load_snapshot(students=not args.set_based)
+    for table in args.tables:
+        if table == "3":
+            save_table3_to_database(snapshot, args.batch_size, incremental=not args.full, set_based=args.set_based)
+        elif table == "4":
+            save_table4_to_database(snapshot, args.batch_size, incremental=not args.full, set_based=args.set_based)
+        else:
+            raise SystemExit(f"Only tables 3 and 4 can be materialized, not {table}.")
+
+
+def run_add_course(args):
+    register_course(args.course, args.program)
+
+
+def run_batch_command(args):
+    stages = report_stages()
+    unknown = [name for name in args.stages if name not in stages]
+    if unknown:
+        raise SystemExit(f"Unknown stages: {', '.join(unknown)}. Choose from {', '.join(stages)}.")
+    run_batch(args.courses, args.stages, args.workers, args.stage_workers, args.output_root, args.executor,
+              args.prefetch, incremental=not args.full, stream=args.stream, batch_size=args.batch_size,
+              set_based=args.set_based, formulas=args.formulas, export_format=args.export_format)
+
+
+def run_pipeline(args):
+    stages = report_stages(incremental=not args.full, stream=args.stream, batch_size=args.batch_size,
+                           set_based=args.set_based, formulas=args.formulas, export_format=args.export_format)
+    unknown = [name for name in args.stages if name not in stages]
+    if unknown:
+        raise SystemExit(f"Unknown stages: {', '.join(unknown)}. Choose from {', '.join(stages)}.")
+    run_stages(stages, args.stages, workers=args.workers)
+
+
+def build_parser():
+    parser = argparse.ArgumentParser(description="Program outcome / course outcome relation matrix reports.")
+    parser.add_argument("--backend", choices=["sqlserver", "sqlite"], help="storage backend")
+    parser.add_argument("--location", help="SQL Server instance or SQLite database file")
+    parser.add_argument("--course", help=f"course whose data is entered and reported (default: {DEFAULT_COURSE})")
+    parser.add_argument("--pool-size", type=int, help="number of pooled database connections")
+    parser.add_argument("--fetch-size", type=int, help="rows read per round trip when streaming result sets")
+    parser.add_argument("--pipeline-depth", type=int,
+                        help=f"chunks read or computed ahead while reports are written, 0 to disable "
+                             f"(default: {PIPELINE_DEPTH})")
+    parser.add_argument("--sparse-relations", choices=["auto", "always", "never"],
+                        help="keep the PO x CO relation matrix in CSR form (auto: when scipy is installed and the "
+                             f"matrix is at most {SPARSE_MAX_DENSITY * 100:.0f}%% filled)")
+    parser.add_argument("--student-schema", choices=["wide", "long"],
+                        help="store scores as one column per criterion (wide) or in StudentScores rows (long)")
+    parser.add_argument("--metrics", help="append per-stage metrics as JSON lines to this file")
+    parser.add_argument("--profile", choices=["cprofile", "tracemalloc"], help="record hot spots of each stage")
+    parser.add_argument("--profile-dir", help="directory for cProfile dumps and hot-spot summaries "
+                                                   "(default: profiles)")
+    parser.add_argument("--cache-dir", help="keep computed matrices in this directory between runs")
+    parser.add_argument("--score-store", help="read student scores from a memory-mapped columnar copy kept in "
+                                              "a subdirectory per course, rebuilt when scores change")
+    parser.add_argument("--score-chunk-size", type=int, help="students processed at once from the score store")
+    parser.add_argument("--cache-max-age", type=float, help="evict cached matrices older than this many seconds")
+    parser.add_argument("--cache-max-bytes", type=int, help="evict least recently used matrices above this size")
+    parser.set_defaults(handler=run_interactive)
+    subparsers = parser.add_subparsers(title="commands")
+
+    interactive = subparsers.add_parser("interactive", help="data entry menu followed by every report (default)")
+    interactive.set_defaults(handler=run_interactive)
+
+    init_schema = subparsers.add_parser("init-schema", help="create the database and its tables")
+    init_schema.set_defaults(handler=run_init_schema)
+
+    import_parser = subparsers.add_parser("import", help="load a CSV or XLSX file")
+    import_parser.add_argument("kind", choices=["program_outcomes", "course_outcomes", "relations", "criteria",
+                                                "evaluation_relations", "students"])
+    import_parser.add_argument("path")
+    import_parser.add_argument("--batch-size", type=int)
+    import_parser.set_defaults(handler=run_import)
+
+    report = subparsers.add_parser("report", help="write the Excel reports")
+    report.add_argument("--tables", type=parse_table_list, default=["1", "2", "3", "notes", "4", "5"],
+                        help="comma separated list out of 1,2,3,notes,4,5")
+    report.add_argument("--stream", action="store_true", help="write tables 4 and 5 with write-only workbooks")
+    report.add_argument("--formulas", action="store_true",
+                        help="write Excel formulas for averages, totals and success rates in tables 1, 2, 4 and 5")
+    report.add_argument("--parallel", type=int, metavar="WORKERS",
+                        help="build tables 4 and 5 in this many worker processes")
+    report.add_argument("--output", choices=["shards", "zip"], default="shards",
+                        help="parallel output: one workbook per worker or a zip of per-student files")
+    report.set_defaults(handler=run_report)
+
+    materialize = subparsers.add_parser("materialize", help="write Table3/Table4 to the database")
+    materialize.add_argument("--tables", type=parse_table_list, default=["3", "4"], help="comma separated 3,4")
+    materialize.add_argument("--full", action="store_true", help="rebuild instead of updating changed rows")
+    materialize.add_argument("--batch-size", type=int)
+    materialize.add_argument("--set-based", action="store_true", help="compute the rows inside the database")
+    materialize.set_defaults(handler=run_materialize)
+
+    export = subparsers.add_parser("export", help="write the computed tables as long-format Parquet or Arrow files")
+    export.add_argument("--format", choices=list(EXPORT_FORMATS), default="parquet",
+                        help="Parquet (compressed) or Arrow IPC (uncompressed, memory-mappable)")
+    export.add_argument("--output-dir", default="export")
+    export.add_argument("--tables", type=parse_table_list, help=f"comma separated subset of {', '.join(EXPORT_TABLES)}")
+    export.set_defaults(handler=run_export)
+
+    migrate = subparsers.add_parser("migrate-scores", help="copy the wide Students table into StudentScores")
+    migrate.add_argument("--drop-wide", action="store_true", help="drop the Students table after copying")
+    migrate.add_argument("--force", action="store_true", help="replace scores already in StudentScores")
+    migrate.set_defaults(handler=run_migrate_scores)
+
+    run = subparsers.add_parser("run", help="run report and materialize stages concurrently in dependency order")
+    run.add_argument("--stages", type=parse_table_list,
+                     default=["table1", "table2", "table3", "notes", "table4", "materialize3", "materialize4",
+                              "table5"],
+                     help="comma separated list of table1,table2,table3,notes,table4,materialize3,materialize4,table5,"
+                          "export")
+    run.add_argument("--workers", type=int, default=4, help="number of stages running at the same time")
+    run.add_argument("--full", action="store_true", help="rebuild Table3/Table4 instead of updating changed rows")
+    run.add_argument("--stream", action="store_true", help="write tables 4 and 5 with write-only workbooks")
+    run.add_argument("--formulas", action="store_true",
+                     help="write Excel formulas for averages, totals and success rates in tables 1, 2, 4 and 5")
+    run.add_argument("--batch-size", type=int)
+    run.add_argument("--set-based", action="store_true", help="compute Table3/Table4 rows inside the database")
+    run.add_argument("--export-format", choices=list(EXPORT_FORMATS), default="parquet",
+                     help="file format of the export stage")
+    run.set_defaults(handler=run_pipeline)
+
+    add_course = subparsers.add_parser("add-course", help="register a course and the program it belongs to")
+    add_course.add_argument("course")
+    add_course.add_argument("--program", default=DEFAULT_PROGRAM, help="program whose outcomes the course uses")
+    add_course.set_defaults(handler=run_add_course)
+
+    batch = subparsers.add_parser("batch", help="run the report stages for many courses, one output directory each")
+    batch.add_argument("--courses", type=parse_course_list,
+                       help="comma separated courses (default: every course)")
+    batch.add_argument("--stages", type=parse_table_list,
+                       default=["table1", "table2", "table3", "notes", "table4", "materialize3", "materialize4",
+                                "table5"],
+                       help="comma separated list of table1,table2,table3,notes,table4,materialize3,materialize4,"
+                            "table5,export")
+    batch.add_argument("--workers", type=int, help="number of courses processed at the same time")
+    batch.add_argument("--stage-workers", type=int, default=1, help="number of stages running at once per course")
+    batch.add_argument("--executor", choices=["thread", "process"], default="thread",
+                       help="run courses in threads or in worker processes (process needs a file or server database)")
+    batch.add_argument("--output-root", default="reports", help="reports are written to OUTPUT_ROOT/<course>/")
+    batch.add_argument("--prefetch", type=int,
+                       help="courses whose data is read ahead while earlier courses are written (default: pipeline depth)")
+    batch.add_argument("--full", action="store_true", help="rebuild Table3/Table4 instead of updating changed rows")
+    batch.add_argument("--stream", action="store_true", help="write tables 4 and 5 with write-only workbooks")
+    batch.add_argument("--formulas", action="store_true",
+                       help="write Excel formulas for averages, totals and success rates in tables 1, 2, 4 and 5")
+    batch.add_argument("--batch-size", type=int)
+    batch.add_argument("--set-based", action="store_true", help="compute Table3/Table4 rows inside the database")
+    batch.add_argument("--export-format", choices=list(EXPORT_FORMATS), default="parquet",
+                       help="file format of the export stage")
+    batch.set_defaults(handler=run_batch_command)
+
+    return parser
+
+
+def main(argv=None):
+    args = build_parser().parse_args(argv)
+
+    if args.backend:
+        set_backend(create_backend(args.backend, args.location))
+    if args.pool_size:
+        configure_pool(size=args.pool_size)
+    if args.fetch_size:
+        configure_fetch_size(args.fetch_size)
+    if args.pipeline_depth is not None:
+        configure_pipeline(args.pipeline_depth)
+    if args.student_schema:
+        configure_student_schema(args.student_schema)
+    if args.sparse_relations:
+        configure_sparse_relations(args.sparse_relations)
+    if args.score_store or args.score_chunk_size:
+        configure_score_store(args.score_store or SCORE_STORE_DIR, args.score_chunk_size)
+    if args.cache_dir or args.cache_max_age is not None or args.cache_max_bytes is not None:
+        configure_cache(args.cache_dir or CACHE_DIR, args.cache_max_age, args.cache_max_bytes)
+    if args.metrics or args.profile:
+        configure_metrics(args.metrics or METRICS_PATH, args.profile, args.profile_dir)
+
+    try:
+        with use_course(args.course or DEFAULT_COURSE):
+            args.handler(args)
+    finally:
+        close_pools()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,44 @@
+import os
+import sys
+
+import pytest
+
+# main.py bir paket değil, bulunduğu dizinden içe aktarılır
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import main  # noqa: E402
+
+
+def write_csv(path, header, rows):
+    with open(path, "w", encoding="utf-8", newline="") as file:
+        file.write(",".join(header) + "\n")
+        for row in rows:
+            file.write(",".join("" if value is None else str(value) for value in row) + "\n")
+    return str(path)
+
+
+def import_rows(directory, kind, header, rows):
+    assert main.import_file(kind, write_csv(directory / f"{kind}.csv", header, rows)) == len(rows)
+
+
+@pytest.fixture
+def database(tmp_path, monkeypatch):
+    # Her test kendi bellek içi SQLite veritabanını ve rapor dizinini kullanır
+    monkeypatch.chdir(tmp_path)
+    monkeypatch.setattr(main, "STUDENT_SCHEMA", "wide")
+    monkeypatch.setattr(main, "SCORE_STORE_DIR", None)
+    monkeypatch.setattr(main, "CACHE_DIR", None)
+    main.set_backend(main.SqliteBackend(":memory:"))
+    main.check_tables()
+
+    import_rows(tmp_path, "program_outcomes", ["data"], [["PO 1"], ["PO 2"], ["PO 3"]])
+    import_rows(tmp_path, "course_outcomes", ["data"], [["CO 1"], ["CO 2"], ["CO 3"]])
+    import_rows(tmp_path, "relations", ["ProgramOutcomeID", "CourseOutcomeID", "RelationValue"],
+                [[1, 1, 1], [1, 2, 0.5], [2, 2, 0.8], [2, 3, 0.3], [3, 1, 0.6], [3, 3, 1]])
+    import_rows(tmp_path, "criteria", ["Criteria", "Weight"], [["Vize", 40], ["Final", 60]])
+    import_rows(tmp_path, "evaluation_relations", ["CourseOutcomeID", "Criteria", "RelationValue"],
+                [[1, "Vize", 1], [1, "Final", 1], [2, "Vize", 1], [2, "Final", 0], [3, "Vize", 0], [3, "Final", 1]])
+    import_rows(tmp_path, "students", ["Student", "Vize", "Final"],
+                [[101, 80, 50], [102, 40, 90], [103, 65, 70], [104, 100, 20]])
+    yield tmp_path
+    main.set_backend(None)
@@ -0,0 +1,30 @@
+import pytest
+
+import main
+from conftest import import_rows
+
+pytest.importorskip("pyarrow")
+
+
+@pytest.mark.parametrize("score_store", [False, True])
+def test_unscored_criteria_are_not_exported(database, monkeypatch, score_store):
+    monkeypatch.setattr(main, "STUDENT_SCHEMA", "long")
+    if score_store:
+        monkeypatch.setattr(main, "SCORE_STORE_DIR", str(database / "store"))
+    main.migrate_students_to_long()
+    import_rows(database, "criteria", ["Criteria", "Weight"], [["Quiz", 10], ["Vize", 30], ["Final", 60]])
+    import_rows(database, "students", ["Student", "Quiz", "Vize", "Final"], [[101, 0, 80, 50]])
+
+    (filename,) = main.export_tables(main.load_snapshot(), tables=["student_scores"])
+
+    rows = main.read_export(filename).to_pylist()
+    scores = {(row["student_id"], row["criteria"]): row["score"] for row in rows}
+    assert len(rows) == 9
+    assert scores[(101, "Quiz")] == 0
+    assert (102, "Quiz") not in scores
+    assert scores[(102, "Vize")] == 40
+
+
+def test_unknown_export_table_is_rejected(database):
+    with pytest.raises(ValueError, match="outcome"):
+        main.export_tables(tables=["outcome"])
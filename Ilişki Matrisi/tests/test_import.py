@@ -0,0 +1,25 @@
+import main
+from conftest import import_rows
+
+
+def student_rows():
+    with main.pooled_connection("RelationMatrix") as conn:
+        cursor = conn.cursor()
+        cursor.execute("SELECT Student, Quiz, Vize, Final FROM Students ORDER BY Student")
+        return [tuple(row) for row in cursor.fetchall()]
+
+
+def test_students_import_adds_columns_for_new_criteria(database):
+    import_rows(database, "criteria", ["Criteria", "Weight"], [["Quiz", 10], ["Vize", 30], ["Final", 60]])
+    import_rows(database, "students", ["Student", "Quiz", "Vize", "Final"], [[101, 70, 80, 50], [105, 90, 60, 40]])
+
+    assert student_rows() == [(101, 70, 80, 50), (102, None, 40, 90), (103, None, 65, 70), (104, None, 100, 20),
+                              (105, 90, 60, 40)]
+
+
+def test_students_import_rejects_missing_criterion_column(database):
+    assert main.import_file("students", str(database / "students.csv")) == 4
+    path = database / "partial.csv"
+    path.write_text("Student,Vize\n101,80\n", encoding="utf-8")
+
+    assert main.import_file("students", str(path)) == 0
@@ -0,0 +1,88 @@
+import openpyxl
+import pytest
+
+import main
+from conftest import import_rows
+
+
+def table_rows(table_name):
+    # id sütunu ekleme sırasına bağlıdır, karşılaştırmaya girmez
+    with main.pooled_connection("RelationMatrix") as conn:
+        cursor = conn.cursor()
+        cursor.execute(f"SELECT * FROM {table_name}")
+        columns = [column[0] for column in cursor.description]
+        rows = [dict(zip(columns, row)) for row in cursor.fetchall()]
+    for row in rows:
+        del row["id"]
+    key = ("student_id", "course_outcome_id") if table_name == "Table4" else ("course_outcome_id",)
+    return sorted(({name: round(value, 6) if isinstance(value, float) else value for name, value in row.items()}
+                   for row in rows), key=lambda row: tuple(row[name] for name in key))
+
+
+def materialize(incremental, set_based):
+    # Veritabanında hesaplanan yol notları okumadan kendi anlık görüntüsünü yükler
+    snapshot = None if set_based else main.load_snapshot()
+    main.save_table3_to_database(snapshot, incremental=incremental, set_based=set_based)
+    main.save_table4_to_database(snapshot, incremental=incremental, set_based=set_based)
+
+
+@pytest.mark.parametrize("set_based", [False, True])
+def test_incremental_matches_full(database, set_based):
+    materialize(incremental=False, set_based=set_based)
+
+    import_rows(database, "students", ["Student", "Vize", "Final"], [[102, 55, 75]])
+    with main.pooled_connection("RelationMatrix") as conn:
+        cursor = conn.cursor()
+        cursor.execute("UPDATE CourseEvaluationRelations SET RelationValue = 1 WHERE CourseOutcomeID = 3 "
+                       "AND Criteria = 'Vize'")
+        main.log_change(cursor, "CourseEvaluationRelation", 3)
+        conn.commit()
+
+    materialize(incremental=True, set_based=set_based)
+    incremental = table_rows("Table3"), table_rows("Table4")
+    materialize(incremental=False, set_based=set_based)
+    full = table_rows("Table3"), table_rows("Table4")
+
+    assert incremental == full
+    student = next(row for row in full[1] if row["student_id"] == 102 and row["course_outcome_id"] == 3)
+    assert student["Vize"] == pytest.approx(55 * 0.4)
+
+
+@pytest.mark.parametrize("set_based", [False, True])
+def test_criterion_without_student_column_scores_zero(database, set_based):
+    # Students tablosunda Quiz sütunu yok; Quiz notu son sütundan (Final) okunmamalı
+    import_rows(database, "criteria", ["Criteria", "Weight"], [["Quiz", 10], ["Vize", 30], ["Final", 60]])
+    import_rows(database, "evaluation_relations", ["CourseOutcomeID", "Criteria", "RelationValue"],
+                [[1, "Quiz", 1], [1, "Vize", 1], [1, "Final", 1]])
+
+    main.save_table4_to_database(main.load_snapshot(), set_based=set_based)
+
+    row = next(row for row in table_rows("Table4") if row["student_id"] == 101 and row["course_outcome_id"] == 1)
+    assert row["Quiz"] == 0
+    assert row["Vize"] == pytest.approx(80 * 0.3)
+    assert row["Final"] == pytest.approx(50 * 0.6)
+    assert row["total_score"] == pytest.approx(80 * 0.3 + 50 * 0.6)
+
+
+@pytest.mark.parametrize("score_store", [False, True])
+def test_notes_leave_missing_long_scores_blank(database, monkeypatch, score_store):
+    monkeypatch.setattr(main, "STUDENT_SCHEMA", "long")
+    if score_store:
+        monkeypatch.setattr(main, "SCORE_STORE_DIR", str(database / "store"))
+    main.migrate_students_to_long()
+    import_rows(database, "criteria", ["Criteria", "Weight"], [["Quiz", 10], ["Vize", 30], ["Final", 60]])
+
+    main.create_notes(main.load_snapshot())
+
+    sheet = openpyxl.load_workbook(database / "notlar.xlsx").active
+    header = [cell.value for cell in sheet[2]]
+    row = next(dict(zip(header, (cell.value for cell in cells))) for cells in sheet.iter_rows(min_row=3)
+               if cells[0].value == 101)
+    assert row["Quiz"] is None
+    assert row["Average"] == pytest.approx((80 * 30 + 50 * 60) / 90, abs=0.01)
+
+
+def test_migrate_keeps_existing_long_scores(database):
+    assert main.migrate_students_to_long() == 8
+    assert main.migrate_students_to_long() == 0
+    assert main.migrate_students_to_long(force=True) == 8